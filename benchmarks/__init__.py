@@ -0,0 +1,61 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import tempfile
+import time
+
+import yaml
+
+from cloudify.mocks import MockCloudifyContext
+
+from cloudify_migration import CloudifyMigration
+
+
+def get_ctx():
+    ctx = MockCloudifyContext(
+        node_id='benchmark_node_id',
+        node_name='benchmark_node_name',
+        deployment_id='benchmark_deployment',
+        properties={},
+        runtime_properties={})
+    setattr(ctx, 'download_resource', lambda _file_path: _file_path)
+    return ctx
+
+
+def write_yaml_temp_file(yaml_content):
+    handle, file_path = tempfile.mkstemp(suffix='.yaml')
+    with os.fdopen(handle, 'w') as outfile:
+        yaml.dump(yaml_content, outfile, default_flow_style=False)
+    return file_path
+
+
+def get_migration(mapping_yaml, blueprint_yaml=None):
+    mapping_path = write_yaml_temp_file(mapping_yaml)
+    blueprint_path = None
+    if blueprint_yaml is not None:
+        blueprint_path = write_yaml_temp_file(blueprint_yaml)
+    try:
+        return CloudifyMigration(get_ctx(), mapping_path, blueprint_path)
+    finally:
+        os.remove(mapping_path)
+        if blueprint_path:
+            os.remove(blueprint_path)
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
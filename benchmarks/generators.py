@@ -0,0 +1,130 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Synthetic blueprints and mappings for the benchmarks."""
+
+
+def _get_levels(depth):
+    return ['level_{0}'.format(n) for n in range(1, depth)]
+
+
+def _get_nested_value(depth, value):
+    for level in reversed(_get_levels(depth + 1)):
+        value = {level: value}
+    return value
+
+
+def generate_mapping(member_count, path_depth=1, type_count=None):
+    """A mapping that moves member_count variables from source node types to
+    destination node types.
+
+    :param member_count: The number of source, and of destination, members.
+    :param path_depth: How deep under properties each variable is.
+    :param type_count: Also add the first type_count destination node types
+        and remove the matching source node types and their templates.
+    :return: The mapping YAML.
+    """
+    mappings = {}
+    levels = _get_levels(path_depth)
+    for n in range(member_count):
+        variable = 'variable_{0}'.format(n)
+        source_path = ['properties'] + levels + [variable]
+        destination_path = ['properties', 'config'] + levels + [variable]
+        mappings['node.source.{0}'.format(n)] = {
+            'node_type': 'type.source.{0}'.format(n),
+            'mapping_direction': 'source',
+            'mappings': [{
+                'value': variable,
+                'elements_path': '.'.join(source_path),
+                'elements_types': '.'.join(
+                    ['dict'] * (len(source_path) - 1) + ['string'])
+            }]
+        }
+        mappings['node.destination.{0}'.format(n)] = {
+            'node_type': 'type.destination.{0}'.format(n),
+            'mapping_direction': 'destination',
+            'mappings': [{
+                'value': variable,
+                'elements_path': '.'.join(destination_path),
+                'elements_types': '.'.join(
+                    ['dict'] * (len(destination_path) - 1) + ['string'])
+            }]
+        }
+    additions = []
+    removals = []
+    for n in range(type_count or 0):
+        additions.append({
+            'key': 'type.destination.{0}'.format(n),
+            'type': 'node_type',
+            'add': ['node_types', 'node_templates']
+        })
+        removals.append({
+            'key': 'type.source.{0}'.format(n),
+            'type': 'node_type',
+            'remove': ['node_types', 'node_templates']
+        })
+    return {'mappings': mappings, 'additions': additions, 'removals': removals}
+
+
+def generate_blueprint(node_count,
+                       type_count=10,
+                       property_depth=1,
+                       interface_size=0):
+    """A blueprint with node_count node templates spread over type_count of
+    the mapping's source node types.
+
+    :param node_count: The number of node templates.
+    :param type_count: The number of node types.
+    :param property_depth: How deep the config property of a template is.
+    :param interface_size: The number of lifecycle operations of a template.
+    :return: The blueprint YAML.
+    """
+    node_types = {}
+    for n in range(type_count):
+        node_types['type.source.{0}'.format(n)] = {
+            'derived_from': 'cloudify.nodes.Root',
+            'properties': {
+                'variable_{0}'.format(n): {'type': 'string'},
+                'config': {'default': {}}
+            }
+        }
+    node_templates = {}
+    for n in range(node_count):
+        type_index = n % type_count
+        node_template = {
+            'type': 'type.source.{0}'.format(type_index),
+            'properties': {
+                'variable_{0}'.format(type_index): 'value_{0}'.format(n),
+                'config': _get_nested_value(
+                    property_depth, 'config_{0}'.format(n))
+            }
+        }
+        if interface_size:
+            node_template['interfaces'] = {
+                'cloudify.interfaces.lifecycle': dict(
+                    ('operation_{0}'.format(i), {
+                        'implementation': 'scripts/operation_{0}.sh'.format(i),
+                        'inputs': {'node': 'node_{0}'.format(n)}
+                    }) for i in range(interface_size))
+            }
+        node_templates['node_{0}'.format(n)] = node_template
+    return {
+        'tosca_definitions_version': 'cloudify_dsl_1_3',
+        'imports': [],
+        'inputs': {},
+        'node_types': node_types,
+        'node_templates': node_templates,
+        'outputs': {}
+    }
@@ -0,0 +1,71 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Compare merge_into with merge_dicts on deep and on wide property trees.
+
+    python -m benchmarks.merge
+"""
+
+from benchmarks import timed
+from cloudify_migration.utils import merge_dicts, merge_into
+
+REPEAT = 20
+
+
+def generate_tree(depth, width, leaf):
+    """A tree of the given depth where every dict has width keys."""
+    tree = leaf
+    for _ in range(depth):
+        tree = dict(
+            ('key_{0}'.format(n), tree if n == 0 else leaf)
+            for n in range(width))
+    return tree
+
+
+def time_merge(merge, depth, width):
+    # The trees are generated, since deepcopy cannot copy the deep ones.
+    pairs = [(generate_tree(depth, width, 'new'),
+              generate_tree(depth, width, 'old'))
+             for _ in range(REPEAT)]
+
+    def run():
+        for _source, _destination in pairs:
+            merge(_source, _destination)
+
+    try:
+        elapsed, _ = timed(run)
+    except RuntimeError:
+        return 'recursion limit'
+    return '{0:.4f}s'.format(elapsed)
+
+
+def main():
+    cases = [
+        ('deep', 200, 2),
+        ('deeper', 2000, 2),
+        ('wide', 3, 2000),
+        ('deep and wide', 50, 200),
+    ]
+    print '{0:>14} {1:>6} {2:>6} {3:>16} {4:>16}'.format(
+        'tree', 'depth', 'width', 'merge_dicts', 'merge_into')
+    for name, depth, width in cases:
+        print '{0:>14} {1:>6} {2:>6} {3:>16} {4:>16}'.format(
+            name, depth, width,
+            time_merge(merge_dicts, depth, width),
+            time_merge(merge_into, depth, width))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Compare serial and process pool translation of a blueprint fleet.
+
+    python -m benchmarks.parallel [processes]
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+from benchmarks import get_migration, timed
+from benchmarks.generators import generate_blueprint, generate_mapping
+
+BLUEPRINT_COUNT = 32
+NODE_COUNT = 200
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 \
+        else multiprocessing.cpu_count()
+    migration = get_migration(generate_mapping(10))
+    blueprint_directory = tempfile.mkdtemp()
+    try:
+        for n in range(BLUEPRINT_COUNT):
+            file_path = os.path.join(
+                blueprint_directory, 'blueprint_{0}.yaml'.format(n))
+            with open(file_path, 'w') as outfile:
+                yaml.dump(generate_blueprint(NODE_COUNT), outfile)
+        serial, _ = timed(
+            migration.translate_blueprints,
+            [blueprint_directory],
+            os.path.join(blueprint_directory, 'serial'))
+        parallel, _ = timed(
+            migration.translate_blueprints,
+            [blueprint_directory],
+            os.path.join(blueprint_directory, 'parallel'),
+            processes)
+    finally:
+        shutil.rmtree(blueprint_directory)
+    print '{0} blueprints of {1} nodes'.format(BLUEPRINT_COUNT, NODE_COUNT)
+    print 'serial:      {0:.2f}s'.format(serial)
+    print '{0} processes: {1:.2f}s ({2:.1f}x)'.format(
+        processes, parallel, serial / parallel)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Time the phases of a translation on a generated blueprint and mapping.
+
+Every phase runs in its own forked process, so that its peak memory can be
+told apart from the others'. The plan is compiled before forking, so only
+the plan phase includes compiling it. The results are printed as JSON, so
+they can be kept and compared between releases.
+
+    python -m benchmarks.suite --nodes 2000 --members 200 --output out.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import tempfile
+from multiprocessing import Pool
+
+from benchmarks import get_migration, timed
+from benchmarks.generators import generate_blueprint, generate_mapping
+from cloudify_migration.plan import TranslationPlan
+
+# The migration that the phases run against, inherited by every fork.
+_MIGRATION = None
+
+
+def _get_rss_kb():
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * resource.getpagesize() / 1024
+
+
+def _get_peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _plan():
+    TranslationPlan(_MIGRATION._mapping_yaml)
+
+
+def _variables():
+    _MIGRATION._translator = None
+    for key in _MIGRATION.variables:
+        _MIGRATION.variables[key].value
+
+
+def _set_variables():
+    _MIGRATION.set_variables(_MIGRATION.blueprint.copy())
+
+
+def _effect_removals():
+    _MIGRATION._effect_removals(_MIGRATION.blueprint.copy())
+
+
+def _write_translated_blueprint():
+    translated_blueprint = _MIGRATION.translated_blueprint
+    handle, file_path = tempfile.mkstemp(suffix='.yaml')
+    os.close(handle)
+    try:
+        _MIGRATION.write_translated_blueprint(file_path, translated_blueprint)
+        return os.path.getsize(file_path)
+    finally:
+        os.remove(file_path)
+
+
+PHASES = [
+    ('plan', _plan),
+    ('variables', _variables),
+    ('set_variables', _set_variables),
+    ('effect_removals', _effect_removals),
+    ('write_translated_blueprint', _write_translated_blueprint),
+]
+
+
+def _run_phase(phase_index):
+    start_kb = max(_get_rss_kb(), _get_peak_rss_kb())
+    seconds, _ = timed(PHASES[phase_index][1])
+    peak_kb = _get_peak_rss_kb()
+    return {
+        'seconds': seconds,
+        'peak_rss_kb': peak_kb,
+        'peak_growth_kb': max(peak_kb - start_kb, 0)
+    }
+
+
+def run(parameters):
+    global _MIGRATION
+    _MIGRATION = get_migration(
+        generate_mapping(
+            parameters['members'],
+            parameters['path_depth'],
+            parameters['types']),
+        generate_blueprint(
+            parameters['nodes'],
+            parameters['types'],
+            parameters['property_depth'],
+            parameters['interface_size']))
+    # Compiled here, so that the forks share it.
+    _MIGRATION._plan = TranslationPlan(_MIGRATION._mapping_yaml)
+    results = {'parameters': parameters, 'phases': {}}
+    for phase_index, (name, _) in enumerate(PHASES):
+        pool = Pool(1)
+        try:
+            results['phases'][name] = pool.apply(_run_phase, (phase_index,))
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--types', type=int, default=10)
+    parser.add_argument('--property-depth', type=int, default=3)
+    parser.add_argument('--interface-size', type=int, default=5)
+    parser.add_argument('--members', type=int, default=100)
+    parser.add_argument('--path-depth', type=int, default=2)
+    parser.add_argument('--output', help='Also write the results here.')
+    args = parser.parse_args()
+    results = run({
+        'nodes': args.nodes,
+        'types': args.types,
+        'property_depth': args.property_depth,
+        'interface_size': args.interface_size,
+        'members': args.members,
+        'path_depth': args.path_depth
+    })
+    output = json.dumps(
+        results, indent=2, separators=(',', ': '), sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output)
+    print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Show how variable resolution scales with the number of mapping specs.
+
+    python -m benchmarks.variables
+"""
+
+from benchmarks import get_migration, timed
+from benchmarks.generators import generate_mapping
+
+SPEC_COUNTS = [10, 100, 1000, 5000]
+
+
+def resolve_variables(migration):
+    resolved = 0
+    for member in migration.plan.destinations:
+        for spec in member.mapping_specs:
+            if migration.variables.get(spec.value).value is not None:
+                resolved += 1
+    return resolved
+
+
+def main():
+    print '{0:>8} {1:>12} {2:>16}'.format('specs', 'seconds', 'usec per spec')
+    for spec_count in SPEC_COUNTS:
+        migration = get_migration(generate_mapping(spec_count))
+        # Compile the plan up front, so that only resolution is measured.
+        migration.plan
+        elapsed, resolved = timed(resolve_variables, migration)
+        assert resolved == spec_count
+        print '{0:>8} {1:>12.4f} {2:>16.2f}'.format(
+            spec_count, elapsed, elapsed * 1e6 / spec_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Compare parsing and dumping blueprints with libyaml and pure Python.
+
+    python -m benchmarks.yaml_io
+"""
+
+import os
+import tempfile
+
+import yaml
+
+from benchmarks import timed
+from benchmarks.generators import generate_blueprint
+from cloudify_migration.utils import read_yaml_file, write_yaml_file
+
+NODE_COUNTS = [1000, 10000]
+
+
+def get_paths():
+    paths = [('python', yaml.SafeLoader, yaml.SafeDumper)]
+    if yaml.__with_libyaml__:
+        paths.append(('libyaml', yaml.CSafeLoader, yaml.CSafeDumper))
+    return paths
+
+
+def main():
+    print '{0:>8} {1:>8} {2:>10} {3:>10}'.format(
+        'nodes', 'path', 'dump (s)', 'parse (s)')
+    handle, file_path = tempfile.mkstemp(suffix='.yaml')
+    os.close(handle)
+    try:
+        for node_count in NODE_COUNTS:
+            blueprint = generate_blueprint(node_count)
+            for name, loader, dumper in get_paths():
+                dump, _ = timed(write_yaml_file, file_path, blueprint, dumper)
+                parse, parsed = timed(read_yaml_file, file_path, loader)
+                assert parsed == blueprint
+                print '{0:>8} {1:>8} {2:>10.3f} {3:>10.3f}'.format(
+                    node_count, name, dump, parse)
+    finally:
+        os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main()
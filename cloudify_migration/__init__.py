@@ -14,29 +14,88 @@
 #    * limitations under the License.
 
 
-from copy import deepcopy
-from tempfile import NamedTemporaryFile
+import os
+from tempfile import NamedTemporaryFile, mkdtemp
+
+from cloudify.context import NODE_INSTANCE
 
 from cloudify_migration import constants
-from cloudify_migration.blueprint import (
-    MigrationBlueprint,
-    NodeTemplate,
-    NodeType)
-from cloudify_migration.mapping import MigrationMapping
-from cloudify_migration.variables import MigrationVariable
+from cloudify_migration.blueprint import MigrationBlueprint
+from cloudify_migration.diff import iter_blueprint_changes, write_changes
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.incremental import (
+    TranslationGraph,
+    retranslate,
+    translate_with_graph)
+from cloudify_migration.mapping import (
+    MigrationMapping,
+    merge_mapping_documents)
+from cloudify_migration.metrics import (
+    BYTES_WRITTEN,
+    MAPPING_LOAD,
+    WRITE,
+    TranslationMetrics)
+from cloudify_migration.plan import get_translation_plan
+from cloudify_migration.storage import (
+    DocumentCache,
+    get_import_cache,
+    get_yaml_summary)
+from cloudify_migration.translator import (
+    BlueprintTranslator,
+    translate_files_in_parallel)
 from cloudify_migration.utils import (
+    get_yaml_file_paths,
+    read_yaml_documents,
     read_yaml_file,
     write_yaml_file)
+from cloudify_migration.writer import write_blueprint_file
 
 
 class CloudifyMigration(object):
 
     def __init__(self,
                  cloudify_context,
-                 mapping_blueprint_resource, blueprint_yaml=None):
+                 mapping_blueprint_resource, blueprint_yaml=None,
+                 cache_directory=None,
+                 node_limit=None,
+                 import_cache_directory=None,
+                 import_mirror_directory=None):
+        """Migrate a blueprint with a migration mapping.
+
+        :param cloudify_context: The operation context.
+        :param mapping_blueprint_resource: The mapping YAML resource.
+        :param blueprint_yaml: The path of the blueprint to migrate.
+        :param cache_directory: Keep the blueprint and mapping YAML in a
+            DocumentCache here, and only their digests and summaries in
+            the runtime properties.
+        :param node_limit: Refuse to translate blueprints that the mapping
+            would touch more node types and node templates of than this.
+        :param import_cache_directory: Read the blueprint's imports from an
+            ImportCache here, without network access.
+        :param import_mirror_directory: A local mirror of import URLs that
+            are not in the import cache yet.
+        :return: None
+        """
 
         self._ctx = cloudify_context
-        self.runtime_properties = self._ctx.instance.runtime_properties
+        # Operations that no node instance runs, like the batch workflow's,
+        # have nowhere to keep state between operations.
+        self.runtime_properties = \
+            self._ctx.instance.runtime_properties \
+            if self._ctx.type == NODE_INSTANCE else {}
+        self._plan = None
+        self._mapping = None
+        self._translator = None
+        self.node_limit = node_limit
+        self._document_cache = \
+            DocumentCache(cache_directory) if cache_directory else None
+        self._documents = {}
+        self._translation_state = None
+        self._import_cache = get_import_cache(
+            import_cache_directory, import_mirror_directory) \
+            if import_cache_directory else None
+        # Phase durations and counters of everything this migration does.
+        self.metrics = TranslationMetrics()
 
         self.mapping_blueprint_resource = mapping_blueprint_resource
         self.mapping_blueprint_file_path = \
@@ -51,21 +110,22 @@ class CloudifyMigration(object):
     def _blueprint_yaml(self):
         """This is the raw source for the blueprint.
         """
-        if constants.BLUEPRINT_YAML not in self.runtime_properties:
-            return {}
-        return self.runtime_properties[constants.BLUEPRINT_YAML]
+        return self._get_document(
+            constants.BLUEPRINT_YAML, constants.BLUEPRINT_YAML_DIGEST)
 
     @property
     def _mapping_yaml(self):
         """This is the raw source for the mappings
         """
-        if constants.MAPPING_YAML not in self.runtime_properties:
-            return {}
-        return self.runtime_properties[constants.MAPPING_YAML]
+        return self._get_document(
+            constants.MAPPING_YAML, constants.MAPPING_YAML_DIGEST)
 
     @property
     def blueprint(self):
-        return MigrationBlueprint(self._blueprint_yaml)
+        return MigrationBlueprint(
+            self._blueprint_yaml,
+            import_cache=self._import_cache,
+            file_path=self.runtime_properties.get(constants.BLUEPRINT_PATH))
 
     @property
     def logger(self, logger=None):
@@ -73,136 +133,255 @@ class CloudifyMigration(object):
 
     @property
     def mapping(self):
-        return MigrationMapping(self._mapping_yaml)
+        """This migration's own copy of the mapping, which the shared plan
+        never sees, so changing it cannot affect other migrations.
+        """
+        if self._mapping is None:
+            self._mapping = MigrationMapping(self._mapping_yaml)
+        return self._mapping
+
+    @property
+    def plan(self):
+        """The compiled mapping. It is shared by all translations.
+        """
+        if self._plan is None:
+            with self.metrics.phase(MAPPING_LOAD):
+                self._plan = get_translation_plan(
+                    self._mapping_yaml,
+                    self.runtime_properties.get(constants.MAPPING_YAML_DIGEST))
+        return self._plan
 
     @property
     def translated_blueprint(self):
         return self._translate_blueprint()
 
+    @property
+    def translator(self):
+        if self._translator is None:
+            self._translator = BlueprintTranslator(
+                self.plan, self.logger, self.node_limit, self.metrics)
+        return self._translator
+
     @property
     def variables(self):
-        return self._get_variables()
+        return self.translator.variables
 
     def _effect_additions(self, _blueprint=None):
-        _blueprint = _blueprint or self.blueprint
-        for _addition in self.mapping.additions:
-            node_type = _addition.node_type_to_add
-            node_template = _addition.node_template_to_add
-            if _addition.is_node_type and _addition.add_node_types:
-                _blueprint.update_yaml_node_types(node_type.__dict__)
-            if _addition.is_node_type and _addition.add_node_templates:
-                _blueprint.update_yaml_node_templates(node_template.__dict__)
-            else:
-                raise NotImplemented(
-                    'Only node_types can be added right not.')
+        self.translator._effect_additions(_blueprint or self.blueprint)
 
     def _effect_removals(self, _blueprint=None):
-        _blueprint = _blueprint or self.blueprint
-        for _remove in self.mapping.removals:
-            if _remove.is_node_type and _remove.remove_node_types:
-                try:
-                    _blueprint.remove_yaml_node_types(_remove.key)
-                except KeyError:
-                    self.logger.error(
-                        'Won\'t remove node type {0}. Not found.'.format(
-                            _remove.key))
-            if _remove.is_node_type and _remove.remove_node_templates:
-                for k, v in _blueprint.node_templates.iteritems():
-                    if v.type == _remove.key:
-                        _blueprint.remove_yaml_node_templates(k)
-            else:
-                raise NotImplemented(
-                    'Only node_types can be added right not.')
-
-    def _get_variables(self):
-        variable_mappings = {}
-        for member in self.mapping.members:
-            if not member.mapping_direction == 'source':
-                # We only assign variables from source mapping members.
-                continue
-            for mapping_spec in member.mapping_specs:
-                variable = MigrationVariable(
-                    mapping_spec.value,
-                    mapping_spec.specification['specification'])
-                variable_mappings.update({mapping_spec.value: variable})
-        return variable_mappings
+        self.translator._effect_removals(_blueprint or self.blueprint)
+
+    def _get_document(self, document_key, digest_key):
+        if document_key in self.runtime_properties:
+            return self.runtime_properties[document_key]
+        digest = self.runtime_properties.get(digest_key)
+        if digest is None:
+            return {}
+        if digest not in self._documents:
+            if self._document_cache is None:
+                raise MigrationException(
+                    '{0} is in a document cache, '
+                    'but no cache_directory was given.'.format(document_key))
+            self._documents[digest] = self._document_cache.get(digest)
+        return self._documents[digest]
+
+    def _put_document(self, document_key, digest_key, summary_key, content):
+        if self._document_cache is None:
+            self.runtime_properties[document_key] = content
+            return
+        digest = self._document_cache.put(content)
+        self._documents[digest] = content
+        self.runtime_properties.pop(document_key, None)
+        self.runtime_properties[digest_key] = digest
+        self.runtime_properties[summary_key] = get_yaml_summary(content)
+
+    def _get_translation_state(self):
+        if self._translation_state is None and self._document_cache and \
+                constants.TRANSLATION_STATE in self.runtime_properties:
+            state = self.runtime_properties[constants.TRANSLATION_STATE]
+            if state['blueprint'] in self._document_cache and \
+                    state['graph'] in self._document_cache:
+                self._translation_state = (
+                    self._document_cache.get(state['blueprint']),
+                    TranslationGraph.from_dict(
+                        self._document_cache.get(state['graph'])))
+        return self._translation_state
+
+    def _set_translation_state(self, translated_yaml, graph):
+        self._translation_state = (translated_yaml, graph)
+        if self._document_cache:
+            self.runtime_properties[constants.TRANSLATION_STATE] = {
+                'blueprint': self._document_cache.put(translated_yaml),
+                'graph': self._document_cache.put(graph.to_dict())
+            }
 
     def _read_blueprint_yaml(self, blueprint_yaml_file):
+        # Relative imports are relative to the file, not to the cwd of a
+        # later operation.
+        self.runtime_properties[constants.BLUEPRINT_PATH] = \
+            os.path.abspath(blueprint_yaml_file)
         self.update_blueprint_yaml(read_yaml_file(blueprint_yaml_file))
 
     def _read_mapping_yaml(self, mapping_yaml_file):
-        self.update_mapping_yaml(read_yaml_file(mapping_yaml_file))
-
-    def _set_node_type_variable(self,
-                                node_type_key,
-                                mapping_specs,
-                                _blueprint=None):
-        if node_type_key not in _blueprint.node_types:
-            node_type = NodeType(node_type_key, {})
-        else:
-            node_type = _blueprint.node_types.get(node_type_key)
-        for spec in mapping_specs:
-            variable = self.variables.get(spec.value)
-            node_type.update_node(
-                spec.specification['specification'], variable)
-        _blueprint.update_yaml_node_types(node_type.__dict__)
-
-    def _set_node_template_variable(self,
-                                    node_template_key,
-                                    mapping_specs,
-                                    _blueprint=None):
-        if node_template_key not in _blueprint.node_templates:
-            node_template = NodeTemplate(node_template_key, {})
-        else:
-            node_template = _blueprint.node_templates.get(node_template_key)
-        for spec in mapping_specs:
-            variable = self.variables.get(spec.value)
-            node_template.update_node(
-                spec.specification['specification'], variable)
-        _blueprint.update_yaml_node_templates(node_template.__dict__)
+        with self.metrics.phase(MAPPING_LOAD):
+            self.update_mapping_yaml(
+                merge_mapping_documents(
+                    read_yaml_documents(mapping_yaml_file)))
 
     def _write_blueprint_yaml(self, blueprint_path=None, yaml_content=None):
         yaml_content = yaml_content or self.blueprint.yaml
         if not blueprint_path:
             f = NamedTemporaryFile()
             blueprint_path = f.name
-        write_yaml_file(blueprint_path, yaml_content)
+        with self.metrics.phase(WRITE):
+            self.metrics.count(
+                BYTES_WRITTEN,
+                write_blueprint_file(blueprint_path, yaml_content))
         return blueprint_path
 
-    def _translate_blueprint(self):
-        _blueprint = deepcopy(self.blueprint)
-        self._effect_additions(_blueprint)
-        self.set_variables(_blueprint)
-        self._effect_removals(_blueprint)
-        return _blueprint
+    def _translate_blueprint(self, _blueprint=None):
+        return self.translator.translate(_blueprint or self.blueprint)
+
+    def retranslate_blueprint(self):
+        """Translate the blueprint, only redoing the node types and node
+        templates that changed since the previous call. With a document
+        cache, the previous call may have been in an earlier operation.
+        """
+        state = self._get_translation_state()
+        if state is None:
+            translated, graph = translate_with_graph(
+                self.translator, self.blueprint)
+        else:
+            translated, graph, keys = retranslate(
+                self.translator, self.blueprint, state[0], state[1])
+            self.logger.debug(
+                'Translated {0} node types and {1} node templates '
+                'again.'.format(
+                    len(keys[constants.NODE_TYPES]),
+                    len(keys[constants.NODE_TEMPS])))
+        self._set_translation_state(translated.yaml, graph)
+        return translated
 
     def write_translated_blueprint(self, _path=None, _blueprint=None):
         _blueprint = _blueprint or self.translated_blueprint
         return self._write_blueprint_yaml(_path, _blueprint.yaml)
 
+    def translate_with_report(self, output_path=None, store_report=False):
+        """Translate and write the blueprint, and report how long each
+        phase took and what it did, see TranslationMetrics. The report
+        covers everything this migration did so far, mapping load included.
+
+        :param output_path: Where to write the translated blueprint.
+        :param store_report: Also keep the report in the
+            translation_report runtime property.
+        :return: The report, with the path of the translated blueprint.
+        """
+
+        output_path = self.write_translated_blueprint(output_path)
+        report = self.metrics.to_dict()
+        report['output'] = output_path
+        self.metrics.log(self.logger)
+        if store_report:
+            self.runtime_properties[constants.TRANSLATION_REPORT] = report
+        return report
+
+    def dry_run(self, output_path=None, _blueprint=None):
+        """Translate the blueprint and only report what would change, to
+        the log or as a JSON list in output_path. The translated blueprint
+        is never written.
+
+        :param output_path: A JSON file to write the changes to.
+        :param _blueprint: The MigrationBlueprint to translate.
+        :return: The number of entries added, removed and changed.
+        """
+
+        _blueprint = _blueprint or self.blueprint
+        translated = self._translate_blueprint(_blueprint)
+        counts = write_changes(
+            iter_blueprint_changes(_blueprint.yaml, translated.yaml),
+            self.logger, output_path)
+        self.logger.info(
+            'Dry run: {0} entries would be added, {1} removed and {2} '
+            'changed.'.format(counts['added'], counts['removed'],
+                              counts['changed']))
+        return counts
+
+    def estimate_translation(self, _blueprint=None):
+        """Count what the mapping would touch in the blueprint, see
+        TranslationPlan.estimate.
+        """
+        return self.plan.estimate(_blueprint or self.blueprint)
+
+    def translate_blueprints(self,
+                             blueprint_paths,
+                             output_directory=None,
+                             processes=None):
+        """Translate many blueprints against this migration's mapping.
+
+        Every blueprint is translated with the same compiled plan and written
+        to its own file in output_directory. A failure is recorded in the
+        summary and does not stop the remaining blueprints.
+
+        :param blueprint_paths: Blueprint files or directories of them.
+        :param output_directory: Where to write the translated blueprints.
+        :param processes: Translate in this many worker processes.
+        :return: A summary of the translations.
+        """
+
+        output_directory = output_directory or mkdtemp()
+        if not os.path.isdir(output_directory):
+            os.makedirs(output_directory)
+        jobs = []
+        output_names = set()
+        for blueprint_path in get_yaml_file_paths(blueprint_paths):
+            output_name = os.path.basename(blueprint_path)
+            if output_name in output_names:
+                output_name = '{0}-{1}'.format(len(jobs), output_name)
+            output_names.add(output_name)
+            jobs.append(
+                (blueprint_path, os.path.join(output_directory, output_name)))
+        if processes and processes > 1:
+            results = translate_files_in_parallel(
+                self.plan, jobs, processes, self.node_limit)
+            for result in results:
+                if 'error' in result:
+                    self.logger.error(
+                        'Failed to translate blueprint {0}: {1}'.format(
+                            result['blueprint'], result['error']))
+        else:
+            results = [self.translator.translate_file(*job) for job in jobs]
+        failed = len([r for r in results if 'error' in r])
+        summary = {
+            'mapping': self.plan.digest,
+            'output_directory': output_directory,
+            'translated': len(results) - failed,
+            'failed': failed,
+            'blueprints': results
+        }
+        write_yaml_file(
+            os.path.join(output_directory, constants.TRANSLATION_SUMMARY_FILE),
+            summary)
+        return summary
+
     def update_blueprint_yaml(self, blueprint_yaml=None):
-        blueprint_yaml = blueprint_yaml or self.blueprint_yaml
-        self.runtime_properties[constants.BLUEPRINT_YAML] = blueprint_yaml
+        blueprint_yaml = blueprint_yaml or self._blueprint_yaml
+        self._put_document(
+            constants.BLUEPRINT_YAML,
+            constants.BLUEPRINT_YAML_DIGEST,
+            constants.BLUEPRINT_YAML_SUMMARY,
+            blueprint_yaml)
 
     def update_mapping_yaml(self, mapping_yaml=None):
-        mapping_yaml = mapping_yaml or self.mapping_yaml
-        self.runtime_properties[constants.MAPPING_YAML] = mapping_yaml
+        mapping_yaml = mapping_yaml or self._mapping_yaml
+        self._put_document(
+            constants.MAPPING_YAML,
+            constants.MAPPING_YAML_DIGEST,
+            constants.MAPPING_YAML_SUMMARY,
+            mapping_yaml)
+        self._plan = None
+        self._mapping = None
+        self._translator = None
 
     def set_variables(self, _blueprint=None):
-        _blueprint = _blueprint or self.blueprint
-        for member in self.mapping.members:
-            if not member.mapping_direction == 'destination':
-                continue
-            if member.node_type and not member.node_name:
-                self._set_node_type_variable(
-                    member.node_type,
-                    member.mapping_specs,
-                    _blueprint)
-            elif member.node_type and member.node_name:
-                self._set_node_template_variable(
-                    member.node_name,
-                    member.mapping_specs,
-                    _blueprint
-                )
-            else:
-                raise NotImplemented('Unsupported case called.')
+        self.translator.set_variables(_blueprint or self.blueprint)
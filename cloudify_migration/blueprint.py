@@ -13,6 +13,9 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import logging
+from copy import copy, deepcopy
+
 from cloudify_migration.constants import (
     DEFAULT,
     DERIVED,
@@ -27,31 +30,171 @@ from cloudify_migration.constants import (
     RELS,
     REQ,
     ROOT_TYPE,
-    TYPE)
-from cloudify_migration.utils import merge_dicts
+    TYPE,
+    TYPE_HIERARCHY)
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.loader import BlueprintIndex
+from cloudify_migration.utils import (
+    apply_patch,
+    dump_yaml,
+    get_path_index,
+    merge_into,
+    read_yaml_file)
+
+logger = logging.getLogger(__name__)
+
+
+class BlueprintModel(object):
+    """Base of the blueprint and mapping model objects.
+
+    The objects have slots instead of an instance dict. What they serialize
+    to is built on first use and kept until they change, so asking again
+    does not allocate anything. The cached dict is shared, don't change it.
+    """
+
+    __slots__ = ('_serialized', '_yaml_fragment')
+
+    def _serialize(self):
+        raise NotImplementedError()
+
+    def _invalidate(self):
+        self._serialized = None
+        self._yaml_fragment = None
+
+    def to_dict(self):
+        if getattr(self, '_serialized', None) is None:
+            self._serialized = self._serialize()
+        return self._serialized
+
+    def to_yaml_fragment(self):
+        if getattr(self, '_yaml_fragment', None) is None:
+            self._yaml_fragment = dump_yaml(self.to_dict())
+        return self._yaml_fragment
+
+    @property
+    def __dict__(self):
+        return self.to_dict()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
 
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
 
-class BaseBlueprintDict(object):
+
+class BaseBlueprintDict(BlueprintModel):
+
+    __slots__ = ('key', '_definition', '_properties')
 
     def __init__(self, key, definition=None):
         self.key = key
         self.definition = definition or {}
 
+    @property
+    def definition(self):
+        return self._definition
+
+    @definition.setter
+    def definition(self, definition):
+        self._definition = definition
+        self._invalidate()
+
+    def _invalidate(self):
+        super(BaseBlueprintDict, self)._invalidate()
+        self._properties = None
+
+    def _get_properties(self, property_class):
+        # The property objects are built once per definition, every
+        # assignment of the definition drops them.
+        if self._properties is None:
+            self._properties = dict(
+                (k, property_class(k, v))
+                for k, v in self.definition.get(NODE_PROPS, {}).iteritems())
+        return self._properties
+
+    def _serialize(self):
+        return {self.key: self.definition}
+
     def _update_node(self, s, v):
-        self.definition = merge_dicts(s, self.definition, v)
+        # The definition may be shared with another blueprint, so we merge
+        # into a copy of it.
+        self.definition = merge_into(s, deepcopy(self.definition), v)
+
+    @staticmethod
+    def prepare_spec(spec):
+        return spec
 
     def update_node(self, spec, variable):
-        return self._update_node(spec, variable)
+        return self._update_node(self.prepare_spec(spec), variable)
+
+    def apply_patch(self, patch):
+        """Apply a patch from compile_patch to a copy of the definition.
+        Unlike update_node, the definition is only copied once however many
+        specs the patch was compiled from.
+        """
+        self.definition = apply_patch(patch, deepcopy(self.definition))
 
 
 class BlueprintImport(object):
 
-    def __init__(self, key):
+    __slots__ = ('key', 'url', '_import_cache', '_node_types')
+
+    def __init__(self, key, import_cache=None, url=None):
+        """An import of a blueprint. With an import cache, the document it
+        imports can be read offline.
+
+        :param key: The import, as the blueprint has it.
+        :param import_cache: A storage.ImportCache.
+        :param url: The import resolved against the importing document,
+            defaults to key.
+        :return: None
+        """
+
         self.key = key
+        self.url = url or key
+        self._import_cache = import_cache
+        self._node_types = None
+
+    @property
+    def yaml(self):
+        if self._import_cache is None:
+            raise MigrationException(
+                'Cannot read import {0} without an import cache.'.format(
+                    self.key))
+        return self._import_cache.get(self.url)
+
+    @property
+    def imports(self):
+        """The imports of the imported document, resolved against it.
+        """
+        return [
+            BlueprintImport(
+                key, self._import_cache,
+                self._import_cache.resolve(key, self.url))
+            for key in self.yaml.get(IMPORTS) or []
+        ]
+
+    @property
+    def node_types(self):
+        """The node types that the imported document defines itself.
+        """
+        if self._node_types is None:
+            self._node_types = dict(
+                (k, NodeType(k, v))
+                for k, v in (self.yaml.get(NODE_TYPES) or {}).iteritems())
+        return self._node_types
 
 
 class BlueprintInput(BaseBlueprintDict):
 
+    __slots__ = ()
+
     @property
     def type(self):
         return self.definition.get(TYPE)
@@ -68,8 +211,7 @@ class BlueprintInput(BaseBlueprintDict):
     def required(self):
         return self.definition.get(REQ)
 
-    @property
-    def __dict__(self):
+    def _serialize(self):
         data = {}
         if self.type:
             data[TYPE] = self.type
@@ -82,7 +224,9 @@ class BlueprintInput(BaseBlueprintDict):
         return {self.key: data}
 
 
-class NodeTypeProperty(object):
+class NodeTypeProperty(BlueprintModel):
+
+    __slots__ = ('key', '_default', 'definition')
 
     def __init__(self, key, default, definition=None):
         self.key = key
@@ -112,8 +256,7 @@ class NodeTypeProperty(object):
     def required(self):
         return self.definition.get(REQ)
 
-    @property
-    def __dict__(self):
+    def _serialize(self):
         data = {}
         if self.type is not None:
             data[TYPE] = self.type
@@ -126,19 +269,31 @@ class NodeTypeProperty(object):
         return data
 
 
-class NodeTemplateProperty(object):
+class NodeTemplateProperty(BlueprintModel):
+
+    __slots__ = ('key', '_value')
 
     def __init__(self, key, value):
         self.key = key
         self.value = value
 
     @property
-    def __dict__(self):
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._invalidate()
+
+    def _serialize(self):
         return {self.key: self.value}
 
 
 class NodeType(BaseBlueprintDict):
 
+    __slots__ = ()
+
     @property
     def id(self):
         return self.key
@@ -149,55 +304,58 @@ class NodeType(BaseBlueprintDict):
 
     @property
     def properties(self):
-        _properties = {}
-        for k, v in self.definition.get(NODE_PROPS, {}).iteritems():
-            _properties[k] = NodeTypeProperty(k, v)
-        return _properties
+        return self._get_properties(NodeTypeProperty)
 
     @property
     def interfaces(self):
         return self.definition.get(IFACES)
 
-    @property
-    def __dict__(self):
+    def _serialize(self):
         data = {}
         if self.derived_from:
             data[DERIVED] = self.derived_from
         if self.properties:
             prop_data = {}
             for k, v in self.properties.iteritems():
-                prop_data[k] = v.__dict__
+                prop_data[k] = v.to_dict()
             data[NODE_PROPS] = prop_data
         if self.interfaces:
             data[IFACES] = self.interfaces
         return {self.key: data}
 
-    def generate_node_template(self):
+    def generate_node_template(self, effective_node_type=None):
+        """Return a node template of this type, with the defaults of its
+        properties. With effective_node_type, see
+        MigrationBlueprint.get_effective_node_type, the properties and
+        interfaces that the type inherits are included too.
+        """
+        schema = effective_node_type or self.definition
         data = {TYPE: self.key}
-        if self.interfaces:
-            data[IFACES] = self.interfaces
-        if self.properties:
-            prop_data = {}
-            for k, v in self.properties.iteritems():
-                property_value = v.__dict__.get(DEFAULT)
-                if property_value:
-                    prop_data.update({k, property_value})
-            if prop_data:
-                data[NODE_PROPS].update(prop_data)
+        if schema.get(IFACES):
+            data[IFACES] = schema[IFACES]
+        prop_data = {}
+        for k, v in (schema.get(NODE_PROPS) or {}).iteritems():
+            if isinstance(v, dict) and v.get(DEFAULT) is not None:
+                prop_data[k] = v[DEFAULT]
+        if prop_data:
+            data[NODE_PROPS] = prop_data
         return NodeTemplate(
             '{0}_generated'.format(self.key.replace('.', '_')), data)
 
-    def update_node(self, spec, variable):
+    @staticmethod
+    def prepare_spec(spec):
         # TODO: Make this non-retarded.
         if NODE_PROPS in spec:
             for k, v in spec[NODE_PROPS].iteritems():
                 if DEFAULT not in v:
                     spec[NODE_PROPS][k] = {DEFAULT: v}
-        return self._update_node(spec, variable)
+        return spec
 
 
 class NodeTemplate(BaseBlueprintDict):
 
+    __slots__ = ()
+
     @property
     def id(self):
         return self.key
@@ -208,10 +366,7 @@ class NodeTemplate(BaseBlueprintDict):
 
     @property
     def properties(self):
-        _properties = {}
-        for k, v in self.definition.get(NODE_PROPS, {}).iteritems():
-            _properties[k] = NodeTemplateProperty(k, v)
-        return _properties
+        return self._get_properties(NodeTemplateProperty)
 
     @property
     def interfaces(self):
@@ -221,26 +376,31 @@ class NodeTemplate(BaseBlueprintDict):
     def relationships(self):
         return self.definition.get(RELS, [])
 
-    @property
-    def __dict__(self):
+    def _serialize(self):
         data = {TYPE: self.type}
         if self.properties:
-            data[NODE_PROPS] = self.properties
+            prop_data = {}
+            for v in self.properties.itervalues():
+                prop_data.update(v.to_dict())
+            data[NODE_PROPS] = prop_data
         if self.interfaces:
             data[IFACES] = self.interfaces
         return {self.key: data}
 
-    def update_node(self, spec, variable):
+    @staticmethod
+    def prepare_spec(spec):
         # TODO: Make this non-retarded.
         if NODE_PROPS in spec:
             for k, v in spec[NODE_PROPS].iteritems():
                 if DEFAULT in v:
                     spec[NODE_PROPS][k] = v.get(DEFAULT)
-        return self._update_node(spec, variable)
+        return spec
 
 
 class BlueprintOutput(BaseBlueprintDict):
 
+    __slots__ = ()
+
     @property
     def description(self):
         return self.definition.get(DESC)
@@ -249,8 +409,7 @@ class BlueprintOutput(BaseBlueprintDict):
     def value(self):
         return self.definition.get('value')
 
-    @property
-    def __dict__(self):
+    def _serialize(self):
         data = {}
         if self.description:
             data[DESC] = self.description
@@ -262,12 +421,17 @@ class BlueprintOutput(BaseBlueprintDict):
 class MigrationBlueprint(object):
 
     def __init__(self,
-                 blueprint_yaml,
+                 blueprint_yaml=None,
                  imports=None,
                  inputs=None,
                  node_templates=None,
                  node_types=None,
-                 outputs=None):
+                 outputs=None,
+                 copy_on_write=False,
+                 source=None,
+                 pending=None,
+                 import_cache=None,
+                 file_path=None):
         """Convert a Blueprint YAML file into some object.
 
         :param blueprint_yaml:
@@ -276,95 +440,588 @@ class MigrationBlueprint(object):
         :param node_templates:
         :param node_types:
         :param outputs:
+        :param copy_on_write: blueprint_yaml shares its sections with
+            another blueprint, which must not see our changes.
+        :param source: A BlueprintIndex to parse sections from when they
+            are first needed, instead of passing blueprint_yaml.
+        :param pending: What is still to be parsed from source, see
+            _get_pending. Used by copy.
+        :param import_cache: A storage.ImportCache to read the imports
+            from, see imports and get_imported_node_types.
+        :param file_path: The path of the blueprint, which relative imports
+            are resolved against. Defaults to that of source.
         :return: None
         """
 
-        self.yaml = blueprint_yaml
-        self._imports = imports if isinstance(imports, list) else []
+        self._yaml = blueprint_yaml if blueprint_yaml is not None else {}
+        self._source = source
+        self._pending = pending if pending is not None else \
+            self._get_pending(source)
+        # Sections, and keys of sections, that are ours to change.
+        # None means that everything is.
+        self._owned = {} if copy_on_write else None
+        self._imports = imports if isinstance(imports, list) else None
         self._inputs = inputs if isinstance(inputs, dict) else {}
         self._node_templates = node_templates if isinstance(
             node_templates, dict) else {}
         self._node_types = node_types if isinstance(node_types, dict) else {}
         self._outputs = outputs if isinstance(outputs, dict) else {}
+        # Secondary indexes, built on first use and then kept up to date
+        # by the node type and node template mutators.
+        self._node_templates_by_type = None
+        self._node_types_by_parent = None
+        # Node type names to their effective schemas, see
+        # get_effective_node_type.
+        self._effective_node_types = {}
+        self.import_cache = import_cache
+        self.file_path = file_path or (source.file_path if source else None)
+        # Names of the node types of all imports, see
+        # get_imported_node_types.
+        self._imported_node_types = None
+
+    @classmethod
+    def from_file(cls, blueprint_path):
+        """Return a blueprint that only parses the sections, and the entries
+        of sections, of blueprint_path that are asked for.
+        """
+        source = BlueprintIndex(blueprint_path)
+        if not source.indexed:
+            return cls(read_yaml_file(blueprint_path))
+        return cls(source=source)
+
+    @staticmethod
+    def _get_pending(source):
+        # Section keys to the names of the entries that were not parsed
+        # yet, or to None if the section can only be parsed whole.
+        if source is None:
+            return {}
+        return dict(
+            (key, set(source.entries[key]) if key in source.entries else None)
+            for key in source.keys)
+
+    @property
+    def yaml(self):
+        for key in self._pending.keys():
+            self._load_section(key)
+        return self._yaml
+
+    def _mark_owned(self, element_name, keys):
+        if self._owned is not None:
+            self._owned.setdefault(element_name, set()).update(keys)
+
+    def _load_section(self, element_name):
+        if element_name not in self._pending:
+            return
+        names = self._pending.pop(element_name)
+        if names is None:
+            element = self._yaml[element_name] = \
+                self._source.load_section(element_name)
+            self._mark_owned(
+                element_name, element if isinstance(element, dict) else ())
+        elif names:
+            loaded = self._source.load_section(element_name)
+            element = self._own_yaml_element(element_name, {})
+            for name in names:
+                element[name] = loaded[name]
+            self._mark_owned(element_name, names)
+        elif element_name not in self._yaml:
+            self._yaml[element_name] = {}
+            self._mark_owned(element_name, ())
+
+    def _get_pending_entries(self, element_name):
+        # The names of the entries of a section that were not parsed yet.
+        # A section that can only be parsed whole is parsed now.
+        if element_name in self._pending and \
+                self._pending[element_name] is None:
+            self._load_section(element_name)
+        return self._pending.get(element_name, frozenset())
+
+    def _load_entries(self, element_name, keys):
+        names = self._get_pending_entries(element_name)
+        keys = names.intersection(keys)
+        if keys:
+            element = self._own_yaml_element(element_name, {})
+            for key in keys:
+                element[key] = self._source.load_entry(element_name, key)
+            names.difference_update(keys)
+            self._mark_owned(element_name, keys)
+
+    def _get_section(self, element_name, default=None):
+        self._load_section(element_name)
+        return self._yaml.get(element_name, default)
+
+    def _get_entry(self, element_name, key):
+        if key in self._get_pending_entries(element_name):
+            return self._source.load_entry(element_name, key)
+        section = self._yaml.get(element_name)
+        return section.get(key) if isinstance(section, dict) else None
+
+    def _has_entry(self, element_name, key):
+        if key in self._get_pending_entries(element_name):
+            return True
+        section = self._yaml.get(element_name)
+        return isinstance(section, dict) and key in section
 
     @property
     def imports(self):
-        for import_key in self.yaml[IMPORTS]:
-            self._imports.append(
-                BlueprintImport(import_key)
-            )
+        if self._imports is None:
+            self._imports = [
+                BlueprintImport(
+                    import_key, self.import_cache,
+                    self.import_cache.resolve(import_key, self.file_path)
+                    if self.import_cache else None)
+                for import_key in self._get_section(IMPORTS, [])
+            ]
         return self._imports
 
+    def get_imported_node_types(self):
+        """Return the node types of the imports, and of their imports, by
+        name. The first import to define a name wins. Without an import
+        cache, there are none, and imports that are not in it are skipped.
+        """
+        if self._imported_node_types is None:
+            node_types = {}
+            if self.import_cache is not None:
+                seen = set()
+                imports = list(reversed(self.imports))
+                while imports:
+                    _import = imports.pop()
+                    if _import.url in seen:
+                        continue
+                    seen.add(_import.url)
+                    try:
+                        imported_node_types = _import.node_types
+                        nested_imports = _import.imports
+                    except MigrationException as e:
+                        # The blueprint's own types still resolve without it.
+                        logger.warning(
+                            'Skipping import {0}: {1}'.format(
+                                _import.key, e.message))
+                        continue
+                    for name, node_type in imported_node_types.iteritems():
+                        node_types.setdefault(name, node_type)
+                    imports.extend(reversed(nested_imports))
+            self._imported_node_types = node_types
+        return self._imported_node_types
+
     @property
     def inputs(self):
-        for input_key in self.yaml[INPUTS].keys():
-            self._inputs.update(
-                BlueprintInput(input_key, self.yaml.get(input_key)))
+        for input_key, definition in self._get_section(INPUTS, {}).items():
+            if input_key not in self._inputs:
+                self._inputs[input_key] = BlueprintInput(input_key, definition)
         return self._inputs
 
     @property
     def node_types(self):
-        for node_type_name in self.yaml[NODE_TYPES].keys():
-            if node_type_name not in self._node_types.keys():
+        for node_type_name in self._get_section(NODE_TYPES, {}).keys():
+            if node_type_name not in self._node_types:
                 self._node_types.update({
                     node_type_name: NodeType(
                         node_type_name,
-                        self.yaml[NODE_TYPES][node_type_name]
+                        self._yaml[NODE_TYPES][node_type_name]
                     )
                 })
         return self._node_types
 
     @property
     def node_templates(self):
-        for node_name in self.yaml[NODE_TEMPS].keys():
-            if node_name not in self._node_templates.keys():
+        for node_name in self._get_section(NODE_TEMPS, {}).keys():
+            if node_name not in self._node_templates:
                 self._node_templates.update({
                     node_name: NodeTemplate(
                         node_name,
-                        self.yaml[NODE_TEMPS][node_name])
+                        self._yaml[NODE_TEMPS][node_name])
                 })
         return self._node_templates
 
     @property
     def outputs(self):
-        for output_key in self.yaml[OUTPUTS].keys():
-            self._outputs.update(
-                BlueprintOutput(output_key, self.yaml.get(output_key)))
+        for output_key, definition in self._get_section(OUTPUTS, {}).items():
+            if output_key not in self._outputs:
+                self._outputs[output_key] = BlueprintOutput(
+                    output_key, definition)
         return self._outputs
 
+    def get_node_type(self, node_type_key):
+        """Return a node type, or None. Only the node type is parsed if its
+        section was not parsed yet.
+        """
+        if node_type_key not in self._node_types:
+            if not self._has_entry(NODE_TYPES, node_type_key):
+                return None
+            self._node_types[node_type_key] = NodeType(
+                node_type_key, self._get_entry(NODE_TYPES, node_type_key))
+        return self._node_types[node_type_key]
+
+    def get_node_template(self, node_template_key):
+        """Return a node template, or None. Only the node template is parsed
+        if its section was not parsed yet.
+        """
+        if node_template_key not in self._node_templates:
+            if not self._has_entry(NODE_TEMPS, node_template_key):
+                return None
+            self._node_templates[node_template_key] = NodeTemplate(
+                node_template_key,
+                self._get_entry(NODE_TEMPS, node_template_key))
+        return self._node_templates[node_template_key]
+
+    def get_section(self, element_name, default=None):
+        return self._get_section(element_name, default)
+
+    def has_entries(self, element_name):
+        """Whether a section is a dict, without parsing it if possible.
+        """
+        if self._pending.get(element_name) is not None:
+            return True
+        return isinstance(self._get_section(element_name), dict)
+
+    def get_section_keys(self):
+        return set(self._yaml).union(self._pending)
+
+    def get_raw_section(self, element_name):
+        """Return the text of a section as it is in the source file, if none
+        of it was parsed, or None.
+        """
+        if element_name not in self._pending or element_name in self._yaml:
+            return None
+        names = self._pending[element_name]
+        if names is not None and \
+                len(names) != len(self._source.entries[element_name]):
+            return None
+        return self._source.get_raw_section(element_name)
+
+    def iter_section_entries(self, element_name):
+        """Yield the sorted (name, definition, raw) entries of a dict
+        section. raw is the text of an entry that was never parsed, its
+        definition is None then.
+        """
+        names = self._get_pending_entries(element_name)
+        element = self._yaml.get(element_name) or {}
+        for name in sorted(names.union(element)):
+            if name in names:
+                yield name, None, self._source.get_raw_entry(
+                    element_name, name)
+            else:
+                yield name, element[name], None
+
+    def get_entry_indent(self, element_name):
+        if self._source is None:
+            return None
+        return self._source.entry_indents.get(element_name)
+
+    @staticmethod
+    def _add_to_index(index, key, value):
+        index.setdefault(key, set()).add(value)
+
+    @staticmethod
+    def _remove_from_index(index, key, value):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+    @staticmethod
+    def _get_node_template_type(definition):
+        return (definition or {}).get(TYPE, ROOT_TYPE)
+
+    @staticmethod
+    def _get_node_type_parent(definition):
+        return (definition or {}).get(DERIVED, ROOT_TYPE)
+
+    @property
+    def _templates_by_type(self):
+        if self._node_templates_by_type is None:
+            self._node_templates_by_type = {}
+            for name, definition in self._get_section(
+                    NODE_TEMPS, {}).items():
+                self._add_to_index(
+                    self._node_templates_by_type,
+                    self._get_node_template_type(definition),
+                    name)
+        return self._node_templates_by_type
+
+    @property
+    def _types_by_parent(self):
+        if self._node_types_by_parent is None:
+            self._node_types_by_parent = {}
+            for name, definition in self._get_section(
+                    NODE_TYPES, {}).items():
+                self._add_to_index(
+                    self._node_types_by_parent,
+                    self._get_node_type_parent(definition),
+                    name)
+        return self._node_types_by_parent
+
+    def _index_node_templates(self, keys, remove=False):
+        if self._node_templates_by_type is None:
+            return
+        update_index = \
+            self._remove_from_index if remove else self._add_to_index
+        for key in keys:
+            if key in self._yaml.get(NODE_TEMPS, {}):
+                update_index(
+                    self._node_templates_by_type,
+                    self._get_node_template_type(self._yaml[NODE_TEMPS][key]),
+                    key)
+
+    def _index_node_types(self, keys, remove=False):
+        if self._node_types_by_parent is None:
+            return
+        update_index = \
+            self._remove_from_index if remove else self._add_to_index
+        for key in keys:
+            if key in self._yaml.get(NODE_TYPES, {}):
+                update_index(
+                    self._node_types_by_parent,
+                    self._get_node_type_parent(self._yaml[NODE_TYPES][key]),
+                    key)
+
+    def _own_yaml_element(self, element_name, default):
+        element = self._yaml.get(element_name, default)
+        if self._owned is not None and element_name not in self._owned:
+            element = copy(element)
+            self._owned[element_name] = set()
+        self._yaml[element_name] = element
+        return element
+
+    def _own_yaml_element_keys(self, element_name, keys):
+        self._load_entries(element_name, keys)
+        element = self._own_yaml_element(element_name, {})
+        if self._owned is None:
+            return element
+        owned_keys = self._owned[element_name]
+        for key in keys:
+            if key not in owned_keys:
+                if key in element:
+                    element[key] = deepcopy(element[key])
+                owned_keys.add(key)
+        return element
+
     def _update_yaml_list_element(self, element_name, element_content):
-        element = self.yaml.get(element_name, [])
+        self._load_section(element_name)
+        element = self._own_yaml_element(element_name, [])
         if element_content not in element:
             element.append(element_content)
-        self.yaml[element_name] = element
 
     def _update_yaml_dict_element(self, element_name, element_content):
-        element = self.yaml.get(element_name, {})
-        self.yaml[element_name].update(merge_dicts(element_content, element))
+        element = self._own_yaml_element_keys(
+            element_name, element_content.keys())
+        merge_into(element_content, element)
+
+    def _remove_yaml_dict_element_key(self, element_name, key):
+        names = self._get_pending_entries(element_name)
+        if key in names:
+            # Never parsed, so there is nothing else to remove.
+            names.remove(key)
+            return
+        if key not in self._get_section(element_name, {}):
+            raise KeyError(key)
+        del self._own_yaml_element(element_name, {})[key]
+
+    def copy(self):
+        """Return a copy of this blueprint that can be changed without
+        changing this one. Only the parts that the copy changes are copied.
+        """
+        _blueprint = MigrationBlueprint(
+            dict(self._yaml),
+            copy_on_write=True,
+            source=self._source,
+            pending=dict((k, copy(v)) for k, v in self._pending.items()),
+            file_path=self.file_path)
+        # The copy drops what it changes, so it can start from ours.
+        _blueprint._effective_node_types = dict(self._effective_node_types)
+        _blueprint.import_cache = self.import_cache
+        _blueprint._imported_node_types = self._imported_node_types
+        return _blueprint
+
+    def get_derived_node_types(self, node_type_key):
+        """Return the names of the node types that derive from
+        node_type_key, directly or through other types.
+        """
+        derived_types = set()
+        parents = [node_type_key]
+        while parents:
+            for child in self._types_by_parent.get(parents.pop(), ()):
+                if child not in derived_types and child != node_type_key:
+                    derived_types.add(child)
+                    parents.append(child)
+        return derived_types
+
+    def _get_node_type_ancestry(self, node_type_key):
+        # The node type and its ancestors, nearest first, up to the first
+        # one that is resolved already or is neither in the blueprint nor in
+        # its imports, which is returned as well.
+        ancestry = []
+        seen = set()
+        key = node_type_key
+        while key is not None and key not in self._effective_node_types:
+            node_type = self._find_node_type(key)
+            if node_type is None:
+                break
+            if key in seen:
+                raise MigrationException(
+                    'Node type {0} derives from itself: {1}.'.format(
+                        key, ' -> '.join(ancestry + [key])))
+            seen.add(key)
+            ancestry.append(key)
+            key = node_type.definition.get(
+                DERIVED, ROOT_TYPE if key != ROOT_TYPE else None)
+        return ancestry, key
+
+    @staticmethod
+    def _inherit_node_type(node_type_key, definition, parent_key, parent):
+        if parent is None:
+            hierarchy = [parent_key] if parent_key else []
+            properties, interfaces = {}, {}
+        else:
+            hierarchy = list(parent[TYPE_HIERARCHY])
+            properties = dict(parent[NODE_PROPS])
+            interfaces = dict(
+                (name, dict(operations))
+                for name, operations in parent[IFACES].iteritems())
+        hierarchy.append(node_type_key)
+        properties.update(definition.get(NODE_PROPS) or {})
+        for name, operations in (definition.get(IFACES) or {}).iteritems():
+            interfaces.setdefault(name, {}).update(operations or {})
+        return {
+            DERIVED: parent_key,
+            TYPE_HIERARCHY: hierarchy,
+            NODE_PROPS: properties,
+            IFACES: interfaces
+        }
+
+    def _find_node_type(self, node_type_key):
+        # Node types of the blueprint come before those it imports.
+        node_type = self.get_node_type(node_type_key)
+        if node_type is None and self.import_cache is not None:
+            node_type = self.get_imported_node_types().get(node_type_key)
+        return node_type
+
+    def _resolve_node_type(self, node_type_key):
+        if node_type_key not in self._effective_node_types:
+            ancestry, parent_key = self._get_node_type_ancestry(node_type_key)
+            parent = self._effective_node_types.get(parent_key)
+            # Ancestors first, so every type inherits from a resolved one.
+            for key in reversed(ancestry):
+                parent = self._effective_node_types[key] = \
+                    self._inherit_node_type(
+                        key, self._find_node_type(key).definition,
+                        parent_key, parent)
+                parent_key = key
+        return self._effective_node_types.get(node_type_key)
+
+    def get_effective_node_type(self, node_type_key):
+        """Return the schema of a node type with everything it inherits.
+
+        Properties and interface operations of a type override those of its
+        ancestors. With an import cache, ancestors may come from the
+        imports. Each type is only resolved once, until it or one of its
+        ancestors is updated or removed.
+
+        :param node_type_key: The node type.
+        :return: A dict with the derived_from, type_hierarchy, properties
+            and interfaces of the node type, or None if it is not in the
+            blueprint or its imports. type_hierarchy lists the farthest
+            ancestor first.
+        """
+
+        effective_node_type = self._resolve_node_type(node_type_key)
+        if effective_node_type is None:
+            return None
+        return deepcopy(effective_node_type)
+
+    def _invalidate_node_types(self, node_type_keys):
+        if not self._effective_node_types:
+            return
+        for key in node_type_keys:
+            self._effective_node_types.pop(key, None)
+            for derived_key in self.get_derived_node_types(key):
+                self._effective_node_types.pop(derived_key, None)
+
+    def get_path_index(self):
+        """Return every value in the blueprint keyed by its path, a tuple
+        of keys, for bulk lookups.
+        """
+        return get_path_index(self.yaml)
+
+    def get_node_templates_by_type(self, node_type_key, derived=False):
+        """Return the sorted names of the node templates of a type.
+
+        :param node_type_key: The node type.
+        :param derived: Include templates of types derived from it.
+        :return: A list of node template names.
+        """
+
+        node_type_keys = [node_type_key]
+        if derived:
+            node_type_keys.extend(self.get_derived_node_types(node_type_key))
+        if self._node_templates_by_type is None and \
+                self._get_pending_entries(NODE_TEMPS):
+            return sorted(self._find_node_templates_by_type(node_type_keys))
+        node_templates = set()
+        for key in node_type_keys:
+            node_templates.update(self._templates_by_type.get(key, ()))
+        return sorted(node_templates)
+
+    def _find_node_templates_by_type(self, node_type_keys):
+        # Without parsing the node templates that are still in the source,
+        # which the source finds by their types.
+        pending = self._get_pending_entries(NODE_TEMPS)
+        pending_by_type = self._source.get_entries_by_value(
+            NODE_TEMPS, TYPE, ROOT_TYPE)
+        node_templates = set()
+        for key in node_type_keys:
+            node_templates.update(
+                pending.intersection(pending_by_type.get(key, ())))
+        for name, definition in self._yaml.get(NODE_TEMPS, {}).items():
+            if name not in pending and \
+                    self._get_node_template_type(definition) in node_type_keys:
+                node_templates.add(name)
+        return node_templates
 
     def remove_yaml_node_templates(self, node_template_key):
-        try:
-            del self.yaml[NODE_TEMPS][node_template_key]
-        except KeyError:
-            raise
+        self._index_node_templates([node_template_key], remove=True)
+        self._remove_yaml_dict_element_key(NODE_TEMPS, node_template_key)
+        self._node_templates.pop(node_template_key, None)
 
     def remove_yaml_node_types(self, node_type_key):
-        try:
-            del self.yaml[NODE_TYPES][node_type_key]
-        except KeyError:
-            raise
+        self._invalidate_node_types([node_type_key])
+        self._index_node_types([node_type_key], remove=True)
+        self._remove_yaml_dict_element_key(NODE_TYPES, node_type_key)
+        self._node_types.pop(node_type_key, None)
 
     def update_yaml_imports(self, imports):
         self._update_yaml_list_element(IMPORTS, imports)
+        self._imports = None
+        if self._imported_node_types is not None:
+            # Any type may inherit from what the new import defines.
+            self._imported_node_types = None
+            self._effective_node_types = {}
 
     def update_yaml_inputs(self, inputs):
         self._update_yaml_dict_element(INPUTS, inputs)
+        for key in inputs.keys():
+            self._inputs.pop(key, None)
 
     def update_yaml_node_templates(self, node_templates):
+        keys = node_templates.keys()
+        self._index_node_templates(keys, remove=True)
         self._update_yaml_dict_element(NODE_TEMPS, node_templates)
+        self._index_node_templates(keys)
+        for key in keys:
+            self._node_templates.pop(key, None)
 
     def update_yaml_node_types(self, node_types):
+        keys = node_types.keys()
+        self._invalidate_node_types(keys)
+        self._index_node_types(keys, remove=True)
         self._update_yaml_dict_element(NODE_TYPES, node_types)
+        self._index_node_types(keys)
+        for key in keys:
+            self._node_types.pop(key, None)
 
     def update_yaml_outputs(self, outputs):
         self._update_yaml_dict_element(OUTPUTS, outputs)
+        for key in outputs.keys():
+            self._outputs.pop(key, None)
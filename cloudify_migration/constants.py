@@ -14,8 +14,17 @@
 #    * limitations under the License.
 
 # Attribute Names
+BLUEPRINT_PATH = 'blueprint_path'
 BLUEPRINT_YAML = 'blueprint_yaml'
+BLUEPRINT_YAML_DIGEST = 'blueprint_yaml_digest'
+BLUEPRINT_YAML_SUMMARY = 'blueprint_yaml_summary'
 MAPPING_YAML = 'mapping_yaml'
+MAPPING_YAML_DIGEST = 'mapping_yaml_digest'
+MAPPING_YAML_SUMMARY = 'mapping_yaml_summary'
+TRANSLATION_STATE = 'translation_state'
+TRANSLATED_RESOURCE = 'translated_resource'
+TRANSLATION_REPORT = 'translation_report'
+TRANSLATION_SUMMARY = 'translation_summary'
 
 # Migration Mapper YAML Keys
 ADDITIONS = 'additions'
@@ -37,7 +46,30 @@ NODE_TYPES = 'node_types'
 OUTPUTS = 'outputs'
 RELS = 'relationships'
 REQ = 'required'
+TOSCA_VERSION = 'tosca_definitions_version'
 TYPE = 'type'
+TYPE_HIERARCHY = 'type_hierarchy'
+
+# Mapping Values
+ELEMENT_TYPES = ('boolean', 'dict', 'float', 'integer', 'list', 'string')
+MAPPING_DIRECTIONS = ('destination', 'source')
+
+# Merge Policies
+MERGE_APPEND_LISTS = 'append_lists'
+MERGE_ERROR = 'error'
+MERGE_KEEP = 'keep'
+MERGE_OVERWRITE = 'overwrite'
+
+# Plugin
+PLUGIN_NAME = 'migration'
+PLUGIN_PACKAGE_NAME = 'cloudify-migration-plugin'
+PLUGIN_PACKAGE_VERSION = '1.0.0'
+PLUGIN_EXECUTOR = 'central_deployment_agent'
+TRANSLATE_RESOURCE_TASK = 'cloudify_migration.tasks.translate_resource'
+TRANSLATE_BLUEPRINTS_TASK = 'cloudify_migration.tasks.translate_blueprints'
 
 # OTHER
 ROOT_TYPE = 'cloudify.nodes.Root'
+TRANSLATION_CONCURRENCY = 5
+TRANSLATION_SUMMARY_FILE = 'translation-summary.yaml'
+YAML_FILE_EXTENSIONS = ('.yaml', '.yml')
@@ -0,0 +1,146 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+
+from cloudify_migration.constants import (
+    INPUTS,
+    NODE_TEMPS,
+    NODE_TYPES,
+    OUTPUTS)
+
+# Sections whose entries are compared one by one. Other sections are
+# compared whole.
+ENTRY_SECTIONS = (NODE_TYPES, NODE_TEMPS, INPUTS, OUTPUTS)
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+
+def get_changed_paths(old, new):
+    """Compare two trees and return the dotted paths that were added,
+    removed and changed between them. Subtrees that are the same object in
+    both, as copy on write translations leave them, are not walked.
+    """
+    paths = {ADDED: [], REMOVED: [], CHANGED: []}
+    stack = [('', old, new)]
+    while stack:
+        path, _old, _new = stack.pop()
+        if _old is _new:
+            continue
+        if not isinstance(_old, dict) or not isinstance(_new, dict):
+            if _old != _new:
+                paths[CHANGED].append(path)
+            continue
+        for key in _old:
+            if key not in _new:
+                paths[REMOVED].append(_join_path(path, key))
+        for key in _new:
+            if key not in _old:
+                paths[ADDED].append(_join_path(path, key))
+            else:
+                stack.append((_join_path(path, key), _old[key], _new[key]))
+    for change_paths in paths.values():
+        change_paths.sort()
+    return paths
+
+
+def _join_path(path, key):
+    # Keys may be unicode, or not strings at all.
+    return u'{0}.{1}'.format(path, key) if path else unicode(key)
+
+
+def iter_blueprint_changes(old_yaml, new_yaml):
+    """Yield what changed between two blueprints, one entry at a time and
+    sorted, without building a copy of either.
+
+    :param old_yaml: The blueprint before translation.
+    :param new_yaml: The blueprint after translation.
+    :return: A generator of dicts with the section and key of the entry,
+        whether it was added, removed or changed, and for changed entries,
+        the paths that were added, removed and changed in it.
+    """
+
+    for section in sorted(set(old_yaml).union(new_yaml)):
+        old_section = old_yaml.get(section)
+        new_section = new_yaml.get(section)
+        if old_section is new_section:
+            continue
+        if section in ENTRY_SECTIONS and isinstance(old_section, dict) and \
+                isinstance(new_section, dict):
+            keys = sorted(set(old_section).union(new_section))
+        else:
+            keys = [None]
+            old_section = {None: old_section} if section in old_yaml else {}
+            new_section = {None: new_section} if section in new_yaml else {}
+        for key in keys:
+            change = {'section': section, 'key': key}
+            if key not in new_section:
+                change['change'] = REMOVED
+            elif key not in old_section:
+                change['change'] = ADDED
+            elif old_section[key] is new_section[key]:
+                continue
+            else:
+                paths = get_changed_paths(old_section[key], new_section[key])
+                if not any(paths.values()):
+                    continue
+                change['change'] = CHANGED
+                change.update(paths)
+            yield change
+
+
+def format_change(change):
+    """Describe a change in one line, for the log.
+    """
+    name = change['section'] if change['key'] is None else \
+        u'{0} {1}'.format(change['section'], change['key'])
+    details = []
+    for kind in (ADDED, REMOVED, CHANGED):
+        for path in change.get(kind) or []:
+            details.append(u'{0} {1}'.format(kind, path or '(value)'))
+    if details:
+        return u'{0}: {1}'.format(name, ', '.join(details))
+    return u'{0}: {1}'.format(name, change['change'])
+
+
+def write_changes(changes, logger=None, output_path=None):
+    """Stream changes to a JSON file, as a list, or else to logger.
+
+    :param changes: An iterable of changes, see iter_blueprint_changes.
+    :param logger: Where to log the changes if there is no output_path.
+    :param output_path: A JSON file to write the changes to.
+    :return: The number of entries added, removed and changed.
+    """
+
+    counts = {ADDED: 0, REMOVED: 0, CHANGED: 0}
+    outfile = open(output_path, 'w') if output_path else None
+    try:
+        if outfile:
+            outfile.write('[')
+        for change in changes:
+            if outfile:
+                outfile.write(',\n' if any(counts.values()) else '\n')
+                json.dump(change, outfile, sort_keys=True)
+            else:
+                logger.info(format_change(change))
+            counts[change['change']] += 1
+        if outfile:
+            outfile.write('\n]\n')
+    finally:
+        if outfile:
+            outfile.close()
+    return counts
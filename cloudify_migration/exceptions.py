@@ -17,3 +17,4 @@
 class MigrationException(Exception):
     def __init__(self, message):
         self.message = message or "Invalid migration!"
+        super(MigrationException, self).__init__(self.message)
@@ -0,0 +1,215 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+from copy import copy
+
+from cloudify_migration.blueprint import MigrationBlueprint
+from cloudify_migration.constants import NODE_TEMPS, NODE_TYPES
+from cloudify_migration.mapping import TranslationAddition, TranslationRemoval
+from cloudify_migration.utils import get_yaml_digest
+
+# The blueprint sections that translation changes.
+SECTIONS = (NODE_TYPES, NODE_TEMPS)
+
+
+class TranslationGraph(object):
+
+    def __init__(self, rules=None, sources=None):
+        """Record which mapping rules touched which blueprint entries.
+
+        :param rules: Sets of node type and node template names, keyed by
+            section and then by rule digest.
+        :param sources: Digests of the source blueprint's node types and
+            node templates, keyed by section and then by name.
+        :return: None
+        """
+
+        self.rules = rules or {}
+        self.sources = sources or {}
+
+    def touch(self, rule_digest, section, key):
+        self.rules.setdefault(
+            rule_digest, {}).setdefault(section, set()).add(key)
+
+    def forget(self, keys):
+        """Drop what the rules did to these keys, so that it can be
+        recorded again.
+        """
+        for rule_digest in self.rules.keys():
+            touched = self.rules[rule_digest]
+            for section, section_keys in keys.items():
+                if section in touched:
+                    touched[section] -= section_keys
+                    if not touched[section]:
+                        del touched[section]
+            if not touched:
+                del self.rules[rule_digest]
+
+    def update(self, other, keys):
+        """Take what other recorded for these keys.
+        """
+        for rule_digest, touched in other.rules.items():
+            for section, section_keys in touched.items():
+                for key in section_keys & keys.get(section, set()):
+                    self.touch(rule_digest, section, key)
+
+    def to_dict(self):
+        return {
+            'rules': dict(
+                (rule_digest, dict(
+                    (section, sorted(keys))
+                    for section, keys in touched.items()))
+                for rule_digest, touched in self.rules.items()),
+            'sources': self.sources
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            dict((rule_digest, dict(
+                (section, set(keys)) for section, keys in touched.items()))
+                for rule_digest, touched in data['rules'].items()),
+            data['sources'])
+
+
+def get_source_digests(_blueprint):
+    return dict(
+        (section, dict(
+            (key, get_yaml_digest(definition))
+            for key, definition in _blueprint.yaml.get(section, {}).items()))
+        for section in SECTIONS)
+
+
+def get_rule_keys(plan, rule, _blueprint):
+    """Return the node types and node templates that a rule can touch when
+    translating _blueprint. This may include more than it actually touches.
+    """
+    keys = dict((section, set()) for section in SECTIONS)
+    if isinstance(rule, TranslationAddition):
+        if rule.add_node_types:
+            keys[NODE_TYPES].add(rule.key)
+        if rule.add_node_templates:
+            keys[NODE_TEMPS].add(rule.node_template_to_add.key)
+    elif isinstance(rule, TranslationRemoval):
+        if rule.remove_node_types:
+            keys[NODE_TYPES].add(rule.key)
+        if rule.remove_node_templates:
+            # Templates of the type may also come from additions and
+            # from destination members.
+            keys[NODE_TEMPS].update(
+                _blueprint.get_node_templates_by_type(rule.key))
+            for addition in plan.additions:
+                if addition.key == rule.key and addition.add_node_templates:
+                    keys[NODE_TEMPS].add(addition.node_template_to_add.key)
+            for member in plan.destinations:
+                if member.node_name:
+                    keys[NODE_TEMPS].add(member.node_name)
+    elif rule.node_name:
+        keys[NODE_TEMPS].add(rule.node_name)
+    else:
+        keys[NODE_TYPES].add(rule.node_type)
+    return keys
+
+
+def get_inheriting_keys(plan, _blueprint, node_type_keys):
+    """Return the node templates that additions generate from any of
+    node_type_keys or from a type derived from them. They take the
+    defaults their type inherits, so they change with its ancestors.
+    """
+    node_types = set(node_type_keys)
+    for key in node_type_keys:
+        node_types.update(_blueprint.get_derived_node_types(key))
+    return set(
+        addition.node_template_to_add.key for addition in plan.additions
+        if addition.add_node_templates and addition.key in node_types)
+
+
+def translate_with_graph(translator, _blueprint):
+    """Translate _blueprint and record the TranslationGraph that
+    retranslate needs to update the result later.
+    """
+    graph = TranslationGraph(sources=get_source_digests(_blueprint))
+    return translator.translate(_blueprint, graph), graph
+
+
+def retranslate(translator, _blueprint, translated_yaml, graph):
+    """Bring a previous translation up to date with a changed mapping or
+    blueprint.
+
+    Every node type and node template depends on the rules that touch it
+    and on its own source, and generated node templates also on the
+    sources of their type's ancestors. Only those whose rules or sources
+    changed are translated again. The rest are taken from the previous
+    translation.
+
+    :param translator: A BlueprintTranslator with the current plan.
+    :param _blueprint: The current source MigrationBlueprint.
+    :param translated_yaml: The previous translation's YAML.
+    :param graph: The previous translation's TranslationGraph.
+    :return: The translated MigrationBlueprint, its TranslationGraph and
+        the keys that were translated again.
+    """
+
+    plan = translator.plan
+    rule_digests = set(plan.rule_digests.values())
+    changed_rules = rule_digests.symmetric_difference(graph.rules)
+    keys = dict((section, set()) for section in SECTIONS)
+
+    for rule_digest in changed_rules & set(graph.rules):
+        for section, section_keys in graph.rules[rule_digest].items():
+            keys[section].update(section_keys)
+    for rule, rule_digest in plan.rule_digests.items():
+        if rule_digest in changed_rules:
+            for section, section_keys in get_rule_keys(
+                    plan, rule, _blueprint).items():
+                keys[section].update(section_keys)
+    sources = get_source_digests(_blueprint)
+    for section in SECTIONS:
+        old_sources = graph.sources.get(section, {})
+        new_sources = sources[section]
+        for key in set(old_sources) | set(new_sources):
+            if old_sources.get(key) != new_sources.get(key):
+                keys[section].add(key)
+    keys[NODE_TEMPS].update(
+        get_inheriting_keys(plan, _blueprint, keys[NODE_TYPES]))
+
+    partial_graph = TranslationGraph()
+    partial = translator.translate(_blueprint, partial_graph, keys)
+
+    patched_yaml = dict(_blueprint.yaml)
+    for section in SECTIONS:
+        if section not in translated_yaml and section not in partial.yaml:
+            continue
+        patched_section = copy(translated_yaml.get(section, {}))
+        translated_section = partial.yaml.get(section, {})
+        for key in keys[section]:
+            if key in translated_section:
+                patched_section[key] = translated_section[key]
+            else:
+                patched_section.pop(key, None)
+        patched_yaml[section] = patched_section
+
+    new_graph = TranslationGraph(
+        dict((rule_digest, dict(
+            (section, set(section_keys))
+            for section, section_keys in touched.items()))
+            for rule_digest, touched in graph.rules.items()
+            if rule_digest in rule_digests),
+        sources)
+    new_graph.forget(keys)
+    new_graph.update(partial_graph, keys)
+    return (MigrationBlueprint(patched_yaml, copy_on_write=True),
+            new_graph,
+            keys)
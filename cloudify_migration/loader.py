@@ -0,0 +1,210 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import re
+
+import yaml
+from yaml.resolver import Resolver
+
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.utils import YamlLoader
+
+# A plain mapping key at the start of a line, and whatever follows it.
+KEY_PATTERN = re.compile(r'([A-Za-z0-9_][\w.\-/]*)[ \t]*:(?:[ \t]+(.*))?$')
+
+# Anchors and aliases may tie sections together, so files with them are
+# not indexed.
+ANCHOR_PATTERN = re.compile(r'(?:^|[\s\[{,])[&*][^\s\[\]{},]', re.M)
+
+# Keys like 1, yes and null are not strings once parsed, so they cannot be
+# found by their text.
+_RESOLVER = Resolver()
+_STR_TAG = 'tag:yaml.org,2002:str'
+
+
+def _is_string_key(key):
+    """Whether a plain YAML key parses to the same string.
+    """
+    return _RESOLVER.resolve(yaml.ScalarNode, key, (True, False)) == _STR_TAG
+
+
+class BlueprintIndex(object):
+
+    def __init__(self, file_path, loader=YamlLoader):
+        """Find where every top level section of a blueprint file starts
+        and ends, and where the entries of its mapping sections do, without
+        parsing any of it. Sections and entries are then parsed on demand.
+
+        Only block style, single document files without anchors can be
+        indexed. For anything else, indexed is False and the file should be
+        read as a whole.
+
+        :param file_path: The blueprint file.
+        :param loader: The PyYAML loader class.
+        :return: None
+        """
+
+        self.file_path = file_path
+        self.loader = loader
+        with open(file_path, 'r') as stream:
+            self.text = stream.read()
+        # Section keys, in the order of the file.
+        self.keys = []
+        # Section keys to (start, end) offsets in text.
+        self.sections = {}
+        # Section keys to entry names to (start, end) offsets in text, for
+        # the sections whose entries could be found.
+        self.entries = {}
+        # Section keys to the indentation of their entries.
+        self.entry_indents = {}
+        # (section, key) to values to the names of the entries with them,
+        # see get_entries_by_value.
+        self._entries_by_value = {}
+        self.indexed = not ANCHOR_PATTERN.search(self.text) and \
+            self._index()
+
+    def _index(self):
+        section = entry = None
+        offset = 0
+        for line in self.text.splitlines(True):
+            start, offset = offset, offset + len(line)
+            content = line.strip()
+            if not content or content.startswith('#'):
+                continue
+            if not line[0].isspace():
+                if content == '---' and not self.keys:
+                    continue
+                if section is not None and \
+                        (content == '-' or content.startswith('- ')):
+                    # An item of a sequence that is not indented.
+                    self.entries.pop(section, None)
+                    continue
+                match = KEY_PATTERN.match(line.rstrip('\r\n'))
+                if not match or match.group(1) in self.sections or \
+                        not _is_string_key(match.group(1)):
+                    return False
+                self._end_section(section, entry, start)
+                section, entry = match.group(1), None
+                self.keys.append(section)
+                self.sections[section] = [start, None]
+                value = (match.group(2) or '').strip()
+                if not value or value.startswith('#'):
+                    self.entries[section] = {}
+                continue
+            if section is None:
+                return False
+            if section not in self.entries:
+                continue
+            indent = len(line) - len(line.lstrip(' '))
+            if section not in self.entry_indents:
+                self.entry_indents[section] = indent
+            if indent > self.entry_indents[section]:
+                continue
+            match = KEY_PATTERN.match(line[indent:].rstrip('\r\n'))
+            if indent < self.entry_indents[section] or not match or \
+                    match.group(1) in self.entries[section] or \
+                    not _is_string_key(match.group(1)):
+                # Not a mapping of plain keys, it can only be parsed whole.
+                del self.entries[section]
+                continue
+            self._end_entry(section, entry, start)
+            entry = match.group(1)
+            self.entries[section][entry] = [start, None]
+        self._end_section(section, entry, offset)
+        return True
+
+    def _end_entry(self, section, entry, offset):
+        if entry is not None and section in self.entries:
+            self.entries[section][entry][1] = offset
+
+    def _end_section(self, section, entry, offset):
+        if section is not None:
+            self.sections[section][1] = offset
+            self._end_entry(section, entry, offset)
+
+    def _load(self, text):
+        try:
+            return yaml.load(text, Loader=self.loader)
+        except yaml.YAMLError as e:
+            raise MigrationException('Invalid YAML: {0}'.format(str(e)))
+
+    def get_raw_section(self, key):
+        start, end = self.sections[key]
+        return self.text[start:end]
+
+    def get_raw_entry(self, section, name):
+        start, end = self.entries[section][name]
+        return self.text[start:end]
+
+    def load_section(self, key):
+        return (self._load(self.get_raw_section(key)) or {}).get(key)
+
+    def load_entry(self, section, name):
+        return (self._load(self.get_raw_entry(section, name)) or {}).get(name)
+
+    def _find_entry_value(self, section, name, key, default):
+        # The value of a key of an entry, read from the line that sets it
+        # when the entry is a block mapping with the key on a single line,
+        # or else from the parsed entry.
+        lines = self.get_raw_entry(section, name).splitlines()
+        match = KEY_PATTERN.match(lines[0].strip())
+        if match and not match.group(2):
+            indent = value = None
+            for line in lines[1:]:
+                content = line.strip()
+                if not content or content.startswith('#'):
+                    continue
+                line_indent = len(line) - len(line.lstrip(' '))
+                indent = line_indent if indent is None else indent
+                if line_indent > indent:
+                    if value is not None:
+                        # A plain scalar that goes on over more lines.
+                        break
+                    continue
+                match = KEY_PATTERN.match(content)
+                if line_indent < indent or not match:
+                    break
+                if value is not None:
+                    return self._load(value)
+                if match.group(1) == key:
+                    value = match.group(2) or ''
+                    if value[:1] in '|>&*!':
+                        break
+            else:
+                if value is not None:
+                    return self._load(value)
+                return default
+        return (self.load_entry(section, name) or {}).get(key, default)
+
+    def get_entries_by_value(self, section, key, default=None):
+        """Return the values that the entries of a section have for key,
+        like the types of node templates, with the names of the entries
+        that have each. Entries are only parsed when their value cannot
+        be read from their text.
+
+        :param section: A section whose entries were indexed.
+        :param key: A key of the entries.
+        :param default: The value of entries without key.
+        :return: A dict from values to sets of entry names.
+        """
+
+        if (section, key) not in self._entries_by_value:
+            entries_by_value = {}
+            for name in self.entries[section]:
+                entries_by_value.setdefault(
+                    self._find_entry_value(section, name, key, default),
+                    set()).add(name)
+            self._entries_by_value[(section, key)] = entries_by_value
+        return self._entries_by_value[(section, key)]
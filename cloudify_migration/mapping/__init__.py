@@ -13,12 +13,19 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
-from copy import deepcopy
+from cloudify.exceptions import NonRecoverableError
 
 from cloudify_migration import constants
-from cloudify_migration.blueprint import NodeType
-from cloudify_migration.exceptions import MigrationException
-from cloudify_migration.utils import merge_dicts
+from cloudify_migration.blueprint import BlueprintModel, NodeType
+from cloudify_migration.utils import (
+    compile_path,
+    freeze_tree,
+    merge_into,
+    thaw_tree)
+
+# The attributes that mapping members are indexed by, the most selective
+# first.
+INDEXED_ATTRIBUTES = ('node_name', 'node_type', 'mapping_direction')
 
 
 class TranslationBase(object):
@@ -50,14 +57,18 @@ class TranslationAddition(TranslationBase):
         if self.is_node_type:
             return NodeType(self.key)
         else:
-            raise NotImplemented('Additions do not do node templates.')
+            raise NonRecoverableError(
+                'Addition {0} is not of a node type, additions do not do '
+                'node templates.'.format(self.key))
 
     @property
     def node_template_to_add(self):
         if self.is_node_type:
             return self.node_type_to_add.generate_node_template()
         else:
-            raise NotImplemented('Additions do not do node templates.')
+            raise NonRecoverableError(
+                'Addition {0} is not of a node type, additions do not do '
+                'node templates.'.format(self.key))
 
 
 class TranslationRemoval(TranslationBase):
@@ -75,7 +86,9 @@ class TranslationRemoval(TranslationBase):
         return True if 'node_templates' in self.remove else False
 
 
-class MigrationMappingMemberSpecElement(object):
+class MigrationMappingMemberSpecElement(BlueprintModel):
+
+    __slots__ = ('key', 'type', 'index', 'child', 'value')
 
     def __init__(self,
                  element_index,
@@ -115,8 +128,7 @@ class MigrationMappingMemberSpecElement(object):
         else:
             return value
 
-    @property
-    def __dict__(self):
+    def _serialize(self):
         return {
             'index': self.index,
             'key': self.key,
@@ -129,29 +141,35 @@ class MigrationMappingMemberSpec(object):
 
     def __init__(self, mapping_spec):
         self.value = mapping_spec.get('value')
-        self._elements_path = mapping_spec.get('elements_path', '').split('.')
+        self.elements_path = mapping_spec.get('elements_path', '')
+        self.get_path_value, self.set_path_value = \
+            compile_path(self.elements_path)
+        self._elements_path = self.elements_path.split('.')
         self._elements_types = \
             mapping_spec.get('elements_types', '').split('.')
-        self._elements = sorted(self._get_elements(), key=lambda x: x.index)
+        self._elements = self._get_elements()
+        root = self._elements[-1]
+        # Frozen, so that it can never change. Callers get copies.
+        self._specification = freeze_tree(
+            {'specification': {root.key: root.value}})
 
     def _get_elements(self):
+        # From the leaf up, so that every element is built once, with its
+        # child, and the list ends up ordered by index.
         element_list = []
-        reversed_keys = deepcopy(self._elements_path)
-        reversed_types = deepcopy(self._elements_types)
-        reversed_keys.reverse()
-        reversed_types.reverse()
-        for n in range(0, len(reversed_keys)):
-            init_args = {
-                'element_index': n,
-                'element_key': reversed_keys[n],
-                'element_type': reversed_types[n]
-            }
-            if n == 0:
-                init_args.update({'value': self.value})
-            elif n > 0:
-                init_args.update({'child': element_list[0]})
-            e = MigrationMappingMemberSpecElement(**init_args)
-            element_list.insert(0, e)
+        child = None
+        for n, element_key in enumerate(reversed(self._elements_path)):
+            element = MigrationMappingMemberSpecElement(
+                n, element_key, self._elements_types[-1 - n],
+                child=child,
+                value=self.value if child is None else None)
+            if child is not None and isinstance(element.type, dict) and \
+                    isinstance(child.type, list):
+                # A list in a dict holds its items twice, as merging the
+                # elements one by one always left it.
+                element.value[child.key] = child.value + child.value
+            element_list.append(element)
+            child = element
         return element_list
 
     @property
@@ -160,40 +178,7 @@ class MigrationMappingMemberSpec(object):
 
     @property
     def specification(self):
-        previous = None
-        for current in self._elements:
-            if previous:
-                current = self.merge_specification_elements(previous, current)
-            previous = current
-        return {
-            'specification': {
-                current.__dict__['key']: current.__dict__['value']
-            }
-        }
-
-    @staticmethod
-    def merge_specification_elements(older, newer):
-
-        if older.index == newer.index:
-            newer.value.update(merge_dicts(older.value, newer.value))
-        elif older.index == newer.index - 1:
-            if isinstance(newer.type, dict) and isinstance(older.type, dict):
-                if older.key not in newer.value:
-                    newer.value[older.key] = older.value
-            elif isinstance(newer.type, list) and isinstance(
-                    older.type, basestring):
-                if older.value not in newer.value:
-                    newer.value.append(older.value)
-            elif isinstance(newer.type, dict) and isinstance(older.type, list):
-                if older.key not in newer.value:
-                    newer.value[older.key] = older.value
-                elif not isinstance(newer.value[older.key], list):
-                    # TODO: Check this out.
-                    raise MigrationException()
-                else:
-                    newer.value[older.key] = \
-                        newer.value[older.key] + older.value
-        return newer
+        return thaw_tree(self._specification)
 
 
 class MigrationMappingMember(object):
@@ -206,6 +191,7 @@ class MigrationMappingMember(object):
         self.mapping_direction = self.definition.get('mapping_direction')
         self._mapping_specs_yaml = self.definition.get('mappings')
         self._mapping_specs = self._get_mapping_specs()
+        self._merged_specifications = None
 
     @property
     def mapping_specs(self):
@@ -213,13 +199,14 @@ class MigrationMappingMember(object):
 
     @property
     def merged_specifications(self):
-        older = None
-        for mapping_spec in self._mapping_specs:
-            newer = mapping_spec.specification
-            if older:
-                newer = merge_dicts(older, newer)
-            older = newer
-        return newer
+        if self._merged_specifications is None:
+            merged = {}
+            # Where specs conflict, the earlier one wins, so they are
+            # merged in reverse.
+            for mapping_spec in reversed(self._mapping_specs):
+                merge_into(mapping_spec.specification, merged)
+            self._merged_specifications = freeze_tree(merged)
+        return thaw_tree(self._merged_specifications)
 
     def _get_mapping_specs(self):
         mapping_spec_list = []
@@ -233,9 +220,13 @@ class MigrationMapping(object):
 
     def __init__(self, mapping_yaml):
         self._members = {}
+        # Attribute names to attribute values to the members that have them,
+        # in the order they were added.
+        self._indexes = dict(
+            (attribute, {}) for attribute in INDEXED_ATTRIBUTES)
         self.yaml = mapping_yaml
-        self._additions = self.yaml.get(constants.ADDITIONS)
-        self._removals = self.yaml.get(constants.REMOVALS)
+        self._additions = self.yaml.get(constants.ADDITIONS) or []
+        self._removals = self.yaml.get(constants.REMOVALS) or []
         self._mappings = self.yaml.get(constants.MAPPINGS)
         for k, v in self._mappings.items():
             self.update_members(k, MigrationMappingMember(k, v))
@@ -261,13 +252,188 @@ class MigrationMapping(object):
             removal_list.append(TranslationRemoval(_removal))
         return removal_list
 
+    def _index_member(self, member):
+        for attribute, index in self._indexes.iteritems():
+            value = getattr(member, attribute)
+            if value is not None:
+                index.setdefault(value, []).append(member)
+
+    def _unindex_member(self, member):
+        for attribute, index in self._indexes.iteritems():
+            value = getattr(member, attribute)
+            if value is not None:
+                index[value].remove(member)
+                if not index[value]:
+                    del index[value]
+
     def update_members(self, member_key, member_definition):
         if member_key in self._members:
-            member_definition.update(self._members[member_key])
+            self._unindex_member(self._members[member_key])
         self._members[member_key] = member_definition
+        self._index_member(member_definition)
 
     def get_member(self, member_name):
-        for _name, _member in self._members.items():
-            if _name == member_name:
-                return _member
-        return None
+        return self._members.get(member_name)
+
+    def get_members(self,
+                    node_type=None,
+                    node_name=None,
+                    mapping_direction=None):
+        """Return the members that have all of the given attributes. Only
+        the members with the most selective one are looked at.
+
+        :param node_type: The node type of the members.
+        :param node_name: The node template name of the members.
+        :param mapping_direction: source or destination.
+        :return: A list of members, in the order they were added.
+        """
+
+        criteria = [
+            (attribute, value) for attribute, value in zip(
+                INDEXED_ATTRIBUTES, (node_name, node_type, mapping_direction))
+            if value is not None
+        ]
+        if not criteria:
+            return self.members
+        attribute, value = criteria[0]
+        return [
+            member for member in self._indexes[attribute].get(value, ())
+            if all(getattr(member, a) == v for a, v in criteria[1:])
+        ]
+
+
+def _validate_mapping_spec(member_key, spec_yaml, errors):
+    where = 'Mapping {0}, value {1}'.format(
+        member_key, spec_yaml.get('value') if isinstance(
+            spec_yaml, dict) else spec_yaml)
+    if not isinstance(spec_yaml, dict):
+        errors.append('{0}: a mapping must be a dict.'.format(where))
+        return
+    if spec_yaml.get('value') is None:
+        errors.append('{0}: value is missing.'.format(where))
+    path = spec_yaml.get('elements_path')
+    types = spec_yaml.get('elements_types')
+    if not isinstance(path, basestring) or not path:
+        errors.append('{0}: elements_path is missing.'.format(where))
+        return
+    if not isinstance(types, basestring) or not types:
+        errors.append('{0}: elements_types is missing.'.format(where))
+        return
+    keys, types = path.split('.'), types.split('.')
+    if len(keys) != len(types):
+        errors.append(
+            '{0}: elements_path {1} has {2} elements, elements_types {3} '
+            'has {4}.'.format(
+                where, path, len(keys), spec_yaml['elements_types'],
+                len(types)))
+        return
+    if not all(keys):
+        errors.append(
+            '{0}: elements_path {1} has an empty element.'.format(where, path))
+    for n, element_type in enumerate(types):
+        if element_type not in constants.ELEMENT_TYPES:
+            errors.append('{0}: unknown element type {1}.'.format(
+                where, element_type))
+        elif n < len(types) - 1 and element_type not in ('dict', 'list'):
+            errors.append(
+                '{0}: {1} is a {2}, it cannot contain {3}.'.format(
+                    where, keys[n], element_type, keys[n + 1]))
+        elif element_type == 'list' and n < len(types) - 1 and \
+                (n != len(types) - 2 or types[n + 1] != 'string'):
+            errors.append(
+                '{0}: the list {1} can only contain a string.'.format(
+                    where, keys[n]))
+
+
+def _validate_mapping_member(member_key, member_yaml, errors):
+    where = 'Mapping {0}'.format(member_key)
+    if not isinstance(member_yaml, dict):
+        errors.append('{0}: must be a dict.'.format(where))
+        return
+    direction = member_yaml.get('mapping_direction')
+    if direction is not None and \
+            direction not in constants.MAPPING_DIRECTIONS:
+        errors.append('{0}: unknown mapping_direction {1}.'.format(
+            where, direction))
+    if member_yaml.get('node_name') and not member_yaml.get('node_type'):
+        errors.append('{0}: node_name needs a node_type.'.format(where))
+    elif direction == 'destination' and not member_yaml.get('node_type'):
+        errors.append('{0}: node_type is missing.'.format(where))
+    specs = member_yaml.get('mappings')
+    if specs is not None and not isinstance(specs, list):
+        errors.append('{0}: mappings must be a list.'.format(where))
+        return
+    for spec_yaml in specs or []:
+        _validate_mapping_spec(member_key, spec_yaml, errors)
+
+
+def _validate_translation(section, action, definition, errors):
+    if not isinstance(definition, dict):
+        errors.append('{0}: {1} must be a dict.'.format(section, definition))
+        return
+    where = '{0} {1}'.format(section, definition.get('key'))
+    if not definition.get('key'):
+        errors.append('{0}: key is missing.'.format(where))
+    if definition.get('type') != constants.NODE_TYPE:
+        errors.append('{0}: type must be {1}, not {2}.'.format(
+            where, constants.NODE_TYPE, definition.get('type')))
+    targets = definition.get(action)
+    if not isinstance(targets, list) or not targets:
+        errors.append('{0}: {1} must be a list of {2} and {3}.'.format(
+            where, action, constants.NODE_TYPES, constants.NODE_TEMPS))
+        return
+    for target in targets:
+        if target not in (constants.NODE_TYPES, constants.NODE_TEMPS):
+            errors.append('{0}: cannot {1} {2}.'.format(
+                where, action, target))
+
+
+def validate_mapping(mapping_yaml):
+    """Check the shape of a mapping before anything is compiled from it.
+
+    :param mapping_yaml: The parsed migration mapping.
+    :return: A list of the problems found, empty if there are none.
+    """
+
+    errors = []
+    if not isinstance(mapping_yaml, dict):
+        return ['The mapping must be a dict.']
+    mappings = mapping_yaml.get(constants.MAPPINGS)
+    if not isinstance(mappings, dict):
+        errors.append('{0} must be a dict.'.format(constants.MAPPINGS))
+    else:
+        for member_key, member_yaml in sorted(mappings.items()):
+            _validate_mapping_member(member_key, member_yaml, errors)
+    for section, action in ((constants.ADDITIONS, 'add'),
+                            (constants.REMOVALS, 'remove')):
+        definitions = mapping_yaml.get(section)
+        if definitions is None:
+            continue
+        if not isinstance(definitions, list):
+            errors.append('{0} must be a list.'.format(section))
+            continue
+        for definition in definitions:
+            _validate_translation(section, action, definition, errors)
+    return errors
+
+
+def merge_mapping_documents(documents):
+    """Combine the fragments of a multi-document mapping file into one
+    mapping. A member defined in several fragments is taken from the last.
+    """
+    documents = [document for document in documents if document]
+    if len(documents) == 1:
+        return documents[0]
+    mapping_yaml = {
+        constants.MAPPINGS: {},
+        constants.ADDITIONS: [],
+        constants.REMOVALS: []
+    }
+    for document in documents:
+        mapping_yaml[constants.MAPPINGS].update(
+            document.get(constants.MAPPINGS) or {})
+        mapping_yaml[constants.ADDITIONS].extend(
+            document.get(constants.ADDITIONS) or [])
+        mapping_yaml[constants.REMOVALS].extend(
+            document.get(constants.REMOVALS) or [])
+    return mapping_yaml
@@ -0,0 +1,90 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import time
+from contextlib import contextmanager
+
+# Phases, in the order they run.
+MAPPING_LOAD = 'mapping_load'
+VARIABLES = 'variables'
+ADDITIONS = 'additions'
+SET_VARIABLES = 'set_variables'
+REMOVALS = 'removals'
+WRITE = 'write'
+PHASES = (MAPPING_LOAD, VARIABLES, ADDITIONS, SET_VARIABLES, REMOVALS, WRITE)
+
+# Counters.
+NODE_TYPES_TOUCHED = 'node_types_touched'
+NODE_TEMPLATES_TOUCHED = 'node_templates_touched'
+MERGES = 'merges'
+BYTES_WRITTEN = 'bytes_written'
+COUNTERS = (NODE_TYPES_TOUCHED, NODE_TEMPLATES_TOUCHED, MERGES, BYTES_WRITTEN)
+
+
+class TranslationMetrics(object):
+
+    def __init__(self):
+        """Add up how long each phase of translation took, how many times
+        it ran, and a few counters.
+
+        The variables phase is the time spent compiling mapping specs into
+        patches, which is when the values of their variables are extracted.
+        It happens during set_variables, so it is also part of that phase.
+
+        :return: None
+        """
+
+        self.durations = dict((phase, 0.0) for phase in PHASES)
+        self.calls = dict((phase, 0) for phase in PHASES)
+        self.counters = dict((counter, 0) for counter in COUNTERS)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.durations[name] = \
+                self.durations.get(name, 0.0) + time.time() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        self.__init__()
+
+    def to_dict(self):
+        """The report, with durations in seconds.
+        """
+        return {
+            'phases': dict(
+                (phase, {'seconds': round(self.durations[phase], 6),
+                         'calls': self.calls[phase]})
+                for phase in self.durations),
+            'counters': dict(self.counters)
+        }
+
+    def log(self, logger):
+        for phase in sorted(self.durations, key=_get_phase_order):
+            logger.info('{0}: {1:.3f}s in {2} calls.'.format(
+                phase, self.durations[phase], self.calls[phase]))
+        logger.info(', '.join(
+            '{0}: {1}'.format(counter, self.counters[counter])
+            for counter in sorted(self.counters)))
+
+
+def _get_phase_order(phase):
+    return (PHASES.index(phase) if phase in PHASES else len(PHASES), phase)
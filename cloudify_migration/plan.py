@@ -0,0 +1,173 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+from collections import OrderedDict
+
+from cloudify_migration.constants import NODE_TEMPS, NODE_TYPES
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.mapping import MigrationMapping, validate_mapping
+from cloudify_migration.utils import get_yaml_digest
+
+# Compiled plans, keyed by the digest of the mapping YAML they came from,
+# least recently used first. Only the last TRANSLATION_PLANS_LIMIT are kept.
+_TRANSLATION_PLANS = OrderedDict()
+TRANSLATION_PLANS_LIMIT = 16
+
+
+class TranslationPlan(object):
+
+    def __init__(self, mapping_yaml, digest=None):
+        """Compile a mapping YAML into everything a translation needs.
+
+        The plan is built once and never changed afterwards, so it can be
+        shared between translations of any number of blueprints. The mapping
+        is validated first, every problem found is raised at once. The
+        compiled mapping is private, callers that want to change a mapping
+        build their own MigrationMapping.
+
+        :param mapping_yaml: The parsed migration mapping.
+        :param digest: The content hash of mapping_yaml, if already known.
+        :return: None
+        """
+
+        errors = validate_mapping(mapping_yaml)
+        if errors:
+            raise MigrationException(
+                'Invalid mapping:\n{0}'.format('\n'.join(errors)))
+        self.digest = digest or get_yaml_digest(mapping_yaml)
+        self._mapping = MigrationMapping(mapping_yaml)
+        self.members = tuple(self._mapping.members)
+        self.additions = tuple(self._mapping.additions)
+        self.removals = tuple(self._mapping.removals)
+        self.sources = tuple(
+            self._mapping.get_members(mapping_direction='source'))
+        self.destinations = tuple(
+            self._mapping.get_members(mapping_direction='destination'))
+        self._destination_order = dict(
+            (member, n) for n, member in enumerate(self.destinations))
+        self.rule_digests = self._get_rule_digests()
+        self._affected_node_templates = None
+
+    def _get_rule_digests(self):
+        """Fingerprint every addition, destination member and removal.
+        A destination member's fingerprint includes the source specs of the
+        variables it uses, so it changes when they do.
+        """
+        source_specs = {}
+        for member in self.sources:
+            for spec_yaml in member.definition.get('mappings') or []:
+                source_specs[spec_yaml.get('value')] = spec_yaml
+        rule_digests = {}
+        for addition in self.additions:
+            rule_digests[addition] = get_yaml_digest(
+                ['additions', addition.definition])
+        for member in self.destinations:
+            variables = [
+                source_specs.get(spec.value) for spec in member.mapping_specs
+            ]
+            rule_digests[member] = get_yaml_digest(
+                ['mappings', member.key, member.definition, variables])
+        for removal in self.removals:
+            rule_digests[removal] = get_yaml_digest(
+                ['removals', removal.definition])
+        return rule_digests
+
+    def get_destinations(self, node_types=(), node_names=()):
+        """Return the destination members that set variables on the given
+        node types and node templates, in the order they are applied. Only
+        their members are looked at, through the mapping's indexes.
+        """
+        members = set()
+        for node_type in node_types:
+            members.update(
+                member for member in self._mapping.get_members(
+                    node_type=node_type, mapping_direction='destination')
+                if not member.node_name)
+        for node_name in node_names:
+            members.update(self._mapping.get_members(
+                node_name=node_name, mapping_direction='destination'))
+        return sorted(members, key=self._destination_order.get)
+
+    def affects_node_template(self, node_template_key, node_type_key):
+        """Whether translating a node template on its own changes it, that
+        is, whether it is removed with its type or is a mapping destination.
+        """
+        if self._affected_node_templates is None:
+            self._affected_node_templates = (
+                frozenset(member.node_name for member in self.destinations
+                          if member.node_name),
+                frozenset(removal.key for removal in self.removals
+                          if removal.remove_node_templates))
+        node_names, node_types = self._affected_node_templates
+        return node_template_key in node_names or node_type_key in node_types
+
+    @staticmethod
+    def _get_rule_estimate(section, key, node_types, node_templates):
+        return {
+            'rule': section,
+            'key': key,
+            NODE_TYPES: node_types,
+            NODE_TEMPS: node_templates
+        }
+
+    def estimate(self, _blueprint):
+        """Count the node types and node templates that every rule would
+        touch in _blueprint, without translating it.
+
+        :param _blueprint: A MigrationBlueprint.
+        :return: A dict with the counts of each rule, in the order they are
+            applied, and their totals.
+        """
+
+        rules = []
+        for addition in self.additions:
+            rules.append(self._get_rule_estimate(
+                'additions', addition.key,
+                int(addition.add_node_types),
+                int(addition.add_node_templates)))
+        for member in self.destinations:
+            rules.append(self._get_rule_estimate(
+                'mappings', member.key,
+                int(not member.node_name), int(bool(member.node_name))))
+        for removal in self.removals:
+            rules.append(self._get_rule_estimate(
+                'removals', removal.key,
+                int(removal.remove_node_types and
+                    _blueprint.get_node_type(removal.key) is not None),
+                len(_blueprint.get_node_templates_by_type(removal.key))
+                if removal.remove_node_templates else 0))
+        return {
+            'rules': rules,
+            NODE_TYPES: sum(rule[NODE_TYPES] for rule in rules),
+            NODE_TEMPS: sum(rule[NODE_TEMPS] for rule in rules)
+        }
+
+
+def get_translation_plan(mapping_yaml, digest=None):
+    """Return the compiled plan for mapping_yaml, compiling it only once
+    while it is in the cache.
+    """
+    digest = digest or get_yaml_digest(mapping_yaml)
+    plan = _TRANSLATION_PLANS.pop(digest, None)
+    if plan is None:
+        plan = TranslationPlan(mapping_yaml, digest)
+        if len(_TRANSLATION_PLANS) >= TRANSLATION_PLANS_LIMIT:
+            _TRANSLATION_PLANS.popitem(last=False)
+    _TRANSLATION_PLANS[digest] = plan
+    return plan
+
+
+def clear_translation_plans():
+    _TRANSLATION_PLANS.clear()
@@ -0,0 +1,211 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import hashlib
+import os
+from tempfile import NamedTemporaryFile
+from urlparse import urljoin, urlparse
+
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.utils import (
+    get_yaml_digest,
+    get_yaml_file_paths,
+    read_yaml_file,
+    write_yaml_file)
+
+# Import caches, keyed by directory, so that the blueprints of a batch
+# share what was parsed already.
+_IMPORT_CACHES = {}
+
+
+def get_yaml_summary(yaml_content):
+    """Count the entries of each section of a YAML document.
+    """
+    summary = {}
+    for key, value in yaml_content.items():
+        if isinstance(value, (dict, list)):
+            summary[key] = len(value)
+    return summary
+
+
+class DocumentCache(object):
+
+    def __init__(self, directory):
+        """A local store of YAML documents, addressed by their content hash.
+
+        :param directory: Where to keep the documents.
+        :return: None
+        """
+
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __contains__(self, digest):
+        return os.path.exists(self._get_path(digest))
+
+    def _get_path(self, digest):
+        return os.path.join(self.directory, '{0}.yaml'.format(digest))
+
+    def get(self, digest):
+        if digest not in self:
+            raise MigrationException(
+                'Document {0} is not in {1}.'.format(digest, self.directory))
+        return read_yaml_file(self._get_path(digest))
+
+    def put(self, yaml_content, digest=None):
+        digest = digest or get_yaml_digest(yaml_content)
+        if digest not in self:
+            # Write somewhere else first, so that readers never see half
+            # a document.
+            f = NamedTemporaryFile(dir=self.directory, delete=False)
+            f.close()
+            write_yaml_file(f.name, yaml_content)
+            os.rename(f.name, self._get_path(digest))
+        return digest
+
+
+def is_import_url(import_url):
+    parsed = urlparse(import_url)
+    return bool(parsed.scheme and parsed.netloc)
+
+
+def get_import_key(import_url):
+    """Return what an import is cached under: a URL without its scheme,
+    so that a mirror of host/path serves http and https alike, or an
+    absolute file path.
+    """
+    parsed = urlparse(import_url)
+    if parsed.scheme == 'file':
+        return os.path.abspath(parsed.path)
+    if parsed.scheme and parsed.netloc:
+        return parsed.netloc + parsed.path
+    return os.path.abspath(import_url)
+
+
+class ImportCache(object):
+
+    def __init__(self, directory, mirror_directory=None):
+        """Resolve blueprint imports without network access.
+
+        Imported documents are kept parsed in a DocumentCache, and every
+        import URL points to the digest of its document, so a document that
+        several URLs serve is only kept once. URLs that are not cached yet
+        are looked up in mirror_directory, where the document of
+        http://host/path is at host/path, as wget --mirror lays it out.
+        Imports of local files are read from the files.
+
+        :param directory: Where to keep the cache.
+        :param mirror_directory: A local mirror of import URLs.
+        :return: None
+        """
+
+        self.documents = DocumentCache(directory)
+        self.index_directory = os.path.join(directory, 'imports')
+        if not os.path.isdir(self.index_directory):
+            os.makedirs(self.index_directory)
+        self.mirror_directory = mirror_directory
+        # Import keys to parsed documents.
+        self._parsed = {}
+
+    def _get_index_path(self, key):
+        # Keys of URLs with non-ASCII characters are unicode.
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(
+            self.index_directory, hashlib.sha256(key).hexdigest())
+
+    def _put(self, key, yaml_content):
+        digest = self.documents.put(yaml_content)
+        f = NamedTemporaryFile(dir=self.index_directory, delete=False)
+        f.write(digest)
+        f.close()
+        os.rename(f.name, self._get_index_path(key))
+        self._parsed[key] = yaml_content
+        return digest
+
+    def _get_offline_path(self, import_url, key):
+        if not is_import_url(import_url):
+            return key if os.path.isfile(key) else None
+        if self.mirror_directory:
+            mirror_path = os.path.join(self.mirror_directory, key)
+            if os.path.isfile(mirror_path):
+                return mirror_path
+        return None
+
+    @staticmethod
+    def resolve(import_url, base=None):
+        """Return an import as an absolute URL or path, relative imports
+        being relative to base, the URL or path of the importing document.
+        """
+        if base is None or is_import_url(import_url) or \
+                os.path.isabs(import_url):
+            return import_url
+        if is_import_url(base):
+            return urljoin(base, import_url)
+        return os.path.join(os.path.dirname(base), import_url)
+
+    def get(self, import_url):
+        """Return the parsed document of an import. It is only parsed once
+        per process, and URLs are only read from the mirror once.
+        """
+        key = get_import_key(import_url)
+        if key not in self._parsed:
+            index_path = self._get_index_path(key)
+            if is_import_url(import_url) and os.path.exists(index_path):
+                with open(index_path, 'r') as index_file:
+                    self._parsed[key] = self.documents.get(
+                        index_file.read().strip())
+                return self._parsed[key]
+            path = self._get_offline_path(import_url, key)
+            if path is None:
+                raise MigrationException(
+                    'Import {0} is not in the import cache and cannot be '
+                    'read offline.'.format(import_url))
+            if is_import_url(import_url):
+                self._put(key, read_yaml_file(path))
+            else:
+                # Local files may change, so they are not cached on disk.
+                self._parsed[key] = read_yaml_file(path)
+        return self._parsed[key]
+
+    def put(self, import_url, yaml_content):
+        """Cache the document of an import URL and return its digest.
+        """
+        return self._put(get_import_key(import_url), yaml_content)
+
+    def seed(self, mirror_directory=None):
+        """Cache every YAML document of a mirror directory, see __init__.
+
+        :param mirror_directory: Defaults to the cache's mirror_directory.
+        :return: The number of documents cached.
+        """
+
+        mirror_directory = mirror_directory or self.mirror_directory
+        paths = get_yaml_file_paths([mirror_directory])
+        for path in paths:
+            key = os.path.relpath(path, mirror_directory).replace(os.sep, '/')
+            self._put(key, read_yaml_file(path))
+        return len(paths)
+
+
+def get_import_cache(directory, mirror_directory=None):
+    """Return the ImportCache of directory, creating it only once.
+    """
+    if directory not in _IMPORT_CACHES:
+        _IMPORT_CACHES[directory] = ImportCache(directory, mirror_directory)
+    elif mirror_directory:
+        _IMPORT_CACHES[directory].mirror_directory = mirror_directory
+    return _IMPORT_CACHES[directory]
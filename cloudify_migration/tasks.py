@@ -0,0 +1,239 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+from cloudify import ctx
+from cloudify.context import NODE_INSTANCE
+from cloudify.decorators import operation, workflow
+from cloudify.workflows import ctx as workflow_ctx
+from cloudify.workflows.tasks import DEFAULT_TOTAL_RETRIES
+
+from cloudify_migration import CloudifyMigration, constants
+from cloudify_migration.blueprint import MigrationBlueprint
+from cloudify_migration.diff import iter_blueprint_changes, write_changes
+from cloudify_migration.mapping import merge_mapping_documents
+from cloudify_migration.plan import get_translation_plan
+from cloudify_migration.translator import BlueprintTranslator
+from cloudify_migration.utils import read_yaml_documents
+
+
+@operation
+def translate_blueprints(migration_mapper_resource,
+                         blueprints,
+                         output_directory=None,
+                         processes=None,
+                         cache_directory=None,
+                         node_limit=None,
+                         **_):
+    """Translate a batch of blueprint files against one migration mapping.
+    With processes greater than one, the blueprints are spread over that
+    many worker processes. A blueprint that the mapping would touch more
+    than node_limit nodes of fails without being translated. The summary is
+    returned, and kept in a runtime property when a node instance runs it.
+    """
+    if not isinstance(blueprints, list):
+        blueprints = [blueprints]
+    cfy_migration = CloudifyMigration(
+        ctx, migration_mapper_resource,
+        cache_directory=cache_directory,
+        node_limit=node_limit)
+    summary = cfy_migration.translate_blueprints(
+        blueprints, output_directory, processes)
+    ctx.logger.info(
+        'Translated {0} blueprints into {1}, {2} failed.'.format(
+            summary['translated'],
+            summary['output_directory'],
+            summary['failed']))
+    if ctx.type == NODE_INSTANCE:
+        ctx.instance.runtime_properties[
+            constants.TRANSLATION_SUMMARY] = summary
+    return summary
+
+
+def _get_plan(mapping_path):
+    return get_translation_plan(
+        merge_mapping_documents(read_yaml_documents(mapping_path)))
+
+
+@operation
+def translate_resource(migration_mapper_resource,
+                       dry_run=False,
+                       node_limit=None,
+                       **_):
+    """Translate the node template of this node instance on its own.
+
+    With dry_run, only log what would change. Otherwise keep the translated
+    node template in the translated_resource runtime property, None if the
+    mapping removes it. Node instances that the mapping does not affect are
+    left as they are. The compiled mapping is cached in the process, so
+    tasks that run in the same worker only parse it once.
+    """
+    plan = _get_plan(ctx.download_resource(migration_mapper_resource))
+    if not plan.affects_node_template(ctx.node.id, ctx.node.type):
+        ctx.logger.info(
+            'The mapping does not affect {0}.'.format(ctx.node.id))
+        return
+    translator = BlueprintTranslator(plan, ctx.logger, node_limit)
+    _blueprint = MigrationBlueprint({
+        constants.NODE_TEMPS: {
+            ctx.node.id: {
+                constants.TYPE: ctx.node.type,
+                constants.NODE_PROPS: dict(ctx.node.properties)
+            }
+        }
+    })
+    translated = translator.translate(
+        _blueprint,
+        keys={
+            constants.NODE_TYPES: set(),
+            constants.NODE_TEMPS: set([ctx.node.id])
+        })
+    if dry_run:
+        return write_changes(
+            iter_blueprint_changes(_blueprint.yaml, translated.yaml),
+            ctx.logger)
+    ctx.instance.runtime_properties[constants.TRANSLATED_RESOURCE] = \
+        translated.yaml[constants.NODE_TEMPS].get(ctx.node.id)
+
+
+def _get_host_id(instance):
+    # The id of the node instance that contains instance, or of instance
+    # itself if it is a host.
+    host_node = instance.node.host_node
+    if host_node is None:
+        return None
+    if host_node.id == instance.node_id:
+        return instance.id
+    for host_instance in host_node.instances:
+        if instance in host_instance.get_contained_subgraph():
+            return host_instance.id
+    return None
+
+
+def _get_executor(node):
+    # The node's agent runs the plugin the way the node declares it, and
+    # the plugin declares the deployment's agent.
+    for plugin in node.plugins:
+        if plugin.get('name') == constants.PLUGIN_NAME:
+            return plugin.get('executor') or constants.PLUGIN_EXECUTOR
+    return constants.PLUGIN_EXECUTOR
+
+
+def _get_task_retries():
+    return workflow_ctx.bootstrap_context.get('workflows', {}).get(
+        'task_retries', DEFAULT_TOTAL_RETRIES)
+
+
+def _get_task_context(task_name, executor):
+    # What Cloudify gives an operation of the plugin, as it would for an
+    # operation that is mapped in the node's interfaces.
+    task_context = {
+        'plugin': {
+            'name': constants.PLUGIN_NAME,
+            'package_name': constants.PLUGIN_PACKAGE_NAME,
+            'package_version': constants.PLUGIN_PACKAGE_VERSION
+        },
+        'operation': {
+            'name': task_name,
+            'retry_number': 0,
+            'max_retries': _get_task_retries()
+        },
+        'has_intrinsic_functions': False,
+        'executor': executor
+    }
+    # Central deployment agents run on the manager, so they are given the
+    # environment of its agent.
+    if executor == constants.PLUGIN_EXECUTOR:
+        task_context['execution_env'] = workflow_ctx.bootstrap_context.get(
+            'cloudify_agent', {}).get('env', {})
+    return task_context
+
+
+def _get_node_context(instance):
+    node_context = _get_task_context(
+        constants.TRANSLATE_RESOURCE_TASK, _get_executor(instance.node))
+    node_context.update({
+        'node_id': instance.id,
+        'node_name': instance.node_id,
+        'host_id': _get_host_id(instance)
+    })
+    return node_context
+
+
+@workflow
+def translate_resources(migration_mapper_resource,
+                        dry_run=False,
+                        concurrency=constants.TRANSLATION_CONCURRENCY,
+                        node_limit=None,
+                        **_):
+    """Translate every node instance in its own translate_resource task,
+    which leaves the instances that the mapping does not affect alone.
+
+    The tasks are spread over concurrency chains in the task graph, so that
+    at most that many run at the same time, and the next one of a chain
+    starts while the others are still downloading, parsing, translating or
+    writing. Each task downloads the mapping with the operation context,
+    and compiles it once per worker process.
+    """
+    graph = workflow_ctx.graph_mode()
+    chains = [None] * max(1, int(concurrency))
+    tasks = 0
+    for node in workflow_ctx.nodes:
+        for instance in node.instances:
+            task = workflow_ctx.execute_task(
+                constants.TRANSLATE_RESOURCE_TASK,
+                local=workflow_ctx.local,
+                kwargs={
+                    'migration_mapper_resource': migration_mapper_resource,
+                    'dry_run': dry_run,
+                    'node_limit': node_limit
+                },
+                node_context=_get_node_context(instance))
+            graph.add_task(task)
+            chain = tasks % len(chains)
+            if chains[chain] is not None:
+                graph.add_dependency(task, chains[chain])
+            chains[chain] = task
+            tasks += 1
+    workflow_ctx.logger.info(
+        'Translating {0} node instances, at most {1} at a time.'.format(
+            tasks, len(chains)))
+    return graph.execute()
+
+
+@workflow
+def translate_blueprint_batch(migration_mapper_resource,
+                              blueprints,
+                              output_directory=None,
+                              processes=None,
+                              cache_directory=None,
+                              node_limit=None,
+                              **_):
+    """Run translate_blueprints as a task of the deployment, not of one of
+    its node instances, and return its summary.
+    """
+    return workflow_ctx.execute_task(
+        constants.TRANSLATE_BLUEPRINTS_TASK,
+        local=workflow_ctx.local,
+        kwargs={
+            'migration_mapper_resource': migration_mapper_resource,
+            'blueprints': blueprints,
+            'output_directory': output_directory,
+            'processes': processes,
+            'cache_directory': cache_directory,
+            'node_limit': node_limit
+        },
+        node_context=_get_task_context(
+            constants.TRANSLATE_BLUEPRINTS_TASK,
+            constants.PLUGIN_EXECUTOR)).get()
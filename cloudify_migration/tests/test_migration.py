@@ -15,17 +15,59 @@
 
 
 from copy import deepcopy
+import json
 import os
+import shutil
 import unittest
 import tempfile
+import mock
 import yaml
 
-from cloudify.mocks import MockCloudifyContext
+from cloudify.exceptions import NonRecoverableError
+from cloudify.mocks import MockCloudifyContext, MockNodeContext
+from cloudify.workflows import local
+from cloudify.workflows.tasks_graph import TaskDependencyGraph
 from cloudify.state import current_ctx
 from cloudify_cli.utils import (
     get_import_resolver, is_validate_definitions_version)
 from dsl_parser.parser import parse_from_path
-from cloudify_migration import CloudifyMigration
+from cloudify_migration import CloudifyMigration, tasks
+from cloudify_migration.blueprint import (
+    MigrationBlueprint,
+    NodeTemplate,
+    NodeType)
+from cloudify_migration.diff import (
+    format_change,
+    get_changed_paths,
+    iter_blueprint_changes)
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.mapping import (
+    MigrationMapping,
+    MigrationMappingMember,
+    MigrationMappingMemberSpec,
+    TranslationAddition,
+    validate_mapping)
+from cloudify_migration.incremental import (
+    retranslate,
+    translate_with_graph)
+from cloudify_migration.plan import (
+    TRANSLATION_PLANS_LIMIT,
+    TranslationPlan,
+    get_translation_plan)
+from cloudify_migration.storage import ImportCache
+from cloudify_migration.translator import BlueprintTranslator
+from cloudify_migration.utils import (
+    COMPILED_PATHS_LIMIT,
+    apply_patch,
+    compile_patch,
+    compile_path,
+    merge_into,
+    read_yaml_documents,
+    read_yaml_file)
+from cloudify_migration.variables import MigrationVariable
+from cloudify_migration.writer import (
+    write_blueprint_documents,
+    write_blueprint_file)
 from cloudify_migration.mapping.azure import sources as az_sources
 
 
@@ -65,6 +107,25 @@ class TestMigration(unittest.TestCase):
             resolver=resolver,
             validate_version=validate_version)
 
+    def _get_local_env(self, node_types, node_templates):
+        # A local deployment of a blueprint that imports the plugin, with
+        # the mapping next to it as a blueprint resource.
+        blueprint_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blueprint_directory)
+        shutil.copy(self.migration_mapping_file_name, blueprint_directory)
+        blueprint_path = os.path.join(blueprint_directory, 'blueprint.yaml')
+        with open(blueprint_path, 'w') as f:
+            yaml.dump({
+                'tosca_definitions_version': 'cloudify_dsl_1_3',
+                'imports': [os.path.join(
+                    os.path.dirname(os.path.dirname(
+                        os.path.dirname(os.path.abspath(__file__)))),
+                    'plugin.yaml')],
+                'node_types': node_types,
+                'node_templates': node_templates
+            }, f)
+        return local.init_env(blueprint_path, name=self._testMethodName)
+
     def get_ctx(self,
                 properties=None,
                 runtime_properties=None,
@@ -535,3 +596,1037 @@ class TestMigration(unittest.TestCase):
                 spec,
                 expected_common_spec)
         self.assertEqual(len(member.mapping_specs), 2)
+
+    def test_8_translation_plan_is_shared(self):
+        ctx = self.get_ctx()
+        first = CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        second = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        self.assertIs(first.plan, second.plan)
+        self.assertIs(first.mapping, first.mapping)
+        self.assertIsNot(first.mapping, second.mapping)
+        second.mapping.update_members(
+            'node.type.five', second.mapping.get_member('node.type.four'))
+        self.assertEqual(
+            first.mapping.get_member('node.type.five').key,
+            'node.type.five')
+        self.assertEqual(len(first.plan.sources), 2)
+        self.assertEqual(len(first.plan.destinations), 3)
+        first.translated_blueprint
+        self.assertEqual(
+            first.mapping.get_member(
+                'node.type.five').merged_specifications,
+            self.merged_mapping_specs)
+        mapping_yaml = deepcopy(first._mapping_yaml)
+        mapping_yaml['removals'] = []
+        first.update_mapping_yaml(mapping_yaml)
+        self.assertIsNot(first.plan, second.plan)
+        self.assertEqual(len(first.plan.removals), 0)
+        for index in range(TRANSLATION_PLANS_LIMIT):
+            get_translation_plan({'mappings': {}}, str(index))
+        self.assertIsNot(first.plan, get_translation_plan(first._mapping_yaml))
+
+    def test_9_variables_are_resolved_once(self):
+        ctx = self.get_ctx()
+        cfy_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        variables = cfy_migration.variables
+        self.assertIs(variables, cfy_migration.variables)
+        self.assertIn('variable_one', variables)
+        self.assertIsNone(variables.get('new_variable'))
+        self.assertIs(variables['variable_one'], variables.get('variable_one'))
+        self.assertEqual(variables['variable_two'].value, 'variable_two')
+        cfy_migration.update_mapping_yaml(
+            deepcopy(cfy_migration._mapping_yaml))
+        self.assertIsNot(variables, cfy_migration.variables)
+        self.assertEqual(len(cfy_migration.variables), 2)
+
+    def test_10_translate_blueprints(self):
+        ctx = self.get_ctx()
+        cfy_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name)
+        blueprint_directory = tempfile.mkdtemp()
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blueprint_directory)
+        self.addCleanup(shutil.rmtree, output_directory)
+        for name in ['a.yaml', 'b.yaml']:
+            with open(os.path.join(blueprint_directory, name), 'w') as f:
+                yaml.dump(self.old_blueprint, f, default_flow_style=False)
+        with open(os.path.join(blueprint_directory, 'c.yaml'), 'w') as f:
+            f.write('node_templates: [')
+        summary = cfy_migration.translate_blueprints(
+            [blueprint_directory, self.old_blueprint_file.name],
+            output_directory)
+        self.assertEqual(summary['translated'], 3)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(len(summary['blueprints']), 4)
+        self.assertTrue(
+            summary['blueprints'][2]['error'].startswith('Invalid YAML: '))
+        self.assertTrue(os.path.exists(
+            os.path.join(output_directory, 'translation-summary.yaml')))
+        for result in summary['blueprints']:
+            if 'error' in result:
+                continue
+            with open(result['output']) as f:
+                translated = yaml.load(f)
+            self.assertIn('type.five', translated['node_types'])
+            self.assertNotIn('node_one', translated['node_templates'])
+
+    def test_11_translate_blueprints_in_parallel(self):
+        ctx = self.get_ctx()
+        cfy_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name)
+        blueprint_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blueprint_directory)
+        blueprint_paths = []
+        for n in range(6):
+            blueprint_path = os.path.join(
+                blueprint_directory, '{0}.yaml'.format(n))
+            with open(blueprint_path, 'w') as f:
+                if n == 3:
+                    f.write('node_templates: [')
+                else:
+                    yaml.dump(self.old_blueprint, f, default_flow_style=False)
+            blueprint_paths.append(blueprint_path)
+        serial = cfy_migration.translate_blueprints(
+            blueprint_paths, os.path.join(blueprint_directory, 'serial'))
+        parallel = cfy_migration.translate_blueprints(
+            blueprint_paths, os.path.join(blueprint_directory, 'parallel'),
+            processes=3)
+        self.assertEqual(parallel['translated'], 5)
+        self.assertEqual(parallel['failed'], 1)
+        self.assertEqual(
+            [r['blueprint'] for r in parallel['blueprints']], blueprint_paths)
+        self.assertTrue(
+            parallel['blueprints'][3]['error'].startswith('Invalid YAML: '))
+        self.assertEqual(
+            parallel['blueprints'][3]['error'],
+            serial['blueprints'][3]['error'])
+        for serial_result, parallel_result in zip(
+                serial['blueprints'], parallel['blueprints']):
+            if 'error' in serial_result:
+                continue
+            with open(serial_result['output']) as f:
+                serial_output = yaml.load(f)
+            with open(parallel_result['output']) as f:
+                self.assertEqual(serial_output, yaml.load(f))
+
+    def test_12_translation_copies_on_write(self):
+        ctx = self.get_ctx()
+        blueprint_yaml = self.old_blueprint
+        blueprint_yaml['node_templates']['node_four'] = {
+            'type': 'type.other',
+            'interfaces': {'cloudify.interfaces.lifecycle': {'create': 'x'}}
+        }
+        blueprint_yaml['node_types']['type.three'] = {
+            'derived_from': 'cloudify.nodes.Root',
+            'properties': {'variable_one': {'type': 'string'}}
+        }
+        blueprint_file = self._get_blueprint_file(blueprint_yaml)
+        cfy_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name, blueprint_file.name)
+        source_yaml = deepcopy(cfy_migration.blueprint.yaml)
+        translated = cfy_migration.translated_blueprint
+        self.assertEqual(cfy_migration.blueprint.yaml, source_yaml)
+        self.assertIs(
+            translated.yaml['node_templates']['node_four'],
+            cfy_migration.blueprint.yaml['node_templates']['node_four'])
+        self.assertIsNot(
+            translated.yaml['node_types']['type.three'],
+            cfy_migration.blueprint.yaml['node_types']['type.three'])
+        self.assertEqual(
+            translated.yaml['node_types']['type.three']['properties'],
+            {'variable_one': {'default': 'variable_one', 'type': 'string'}})
+        self.assertNotIn('node_one', translated.yaml['node_templates'])
+        self.assertIn('type.five', translated.yaml['node_types'])
+        self.assertRaises(
+            KeyError, translated.remove_yaml_node_types, 'type.missing')
+
+    def test_13_documents_in_cache_directory(self):
+        ctx = self.get_ctx()
+        cache_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_directory)
+        CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            self.old_blueprint_file.name,
+            cache_directory=cache_directory)
+        runtime_properties = ctx.instance.runtime_properties
+        self.assertNotIn('blueprint_yaml', runtime_properties)
+        self.assertNotIn('mapping_yaml', runtime_properties)
+        self.assertEqual(
+            runtime_properties['blueprint_yaml_summary']['node_templates'], 3)
+        self.assertEqual(
+            runtime_properties['mapping_yaml_summary']['mappings'], 6)
+        self.assertEqual(len(os.listdir(cache_directory)), 2)
+        restored_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            cache_directory=cache_directory)
+        self.assertEqual(
+            restored_migration.blueprint.yaml, self.old_blueprint)
+        self.assertIn(
+            'type.five',
+            restored_migration.translated_blueprint.yaml['node_types'])
+
+    def test_14_multi_document_yaml(self):
+        mapping_yaml = yaml.load(open(self.migration_mapping_file_name))
+        mapping_documents = [
+            {'mappings': mapping_yaml['mappings']},
+            {'additions': mapping_yaml['additions']},
+            {'removals': mapping_yaml['removals']}
+        ]
+        yaml_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, yaml_directory)
+        mapping_path = os.path.join(yaml_directory, 'mapping.yaml')
+        with open(mapping_path, 'w') as f:
+            yaml.safe_dump_all(mapping_documents, f)
+        blueprint_path = os.path.join(yaml_directory, 'blueprints.yaml')
+        with open(blueprint_path, 'w') as f:
+            yaml.safe_dump_all([self.old_blueprint, self.old_blueprint], f)
+        cfy_migration = CloudifyMigration(self.get_ctx(), mapping_path)
+        self.assertEqual(len(cfy_migration.mapping.members), 6)
+        self.assertEqual(len(cfy_migration.plan.additions), 3)
+        self.assertEqual(len(cfy_migration.plan.removals), 2)
+        summary = cfy_migration.translate_blueprints(
+            [blueprint_path], os.path.join(yaml_directory, 'output'))
+        self.assertEqual(summary['blueprints'][0]['documents'], 2)
+        with open(summary['blueprints'][0]['output']) as f:
+            translated = list(yaml.safe_load_all(f))
+        self.assertEqual(len(translated), 2)
+        for document in translated:
+            self.assertIn('type.five', document['node_types'])
+
+    def test_15_blueprint_node_type_index(self):
+        blueprint = MigrationBlueprint(self.old_blueprint)
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.one'), ['node_one'])
+        self.assertEqual(
+            blueprint.get_derived_node_types('cloudify.nodes.Root'),
+            set(['type.one', 'type.two']))
+        self.assertEqual(
+            blueprint.get_node_templates_by_type(
+                'cloudify.nodes.Root', derived=True),
+            ['node_one', 'node_three', 'node_two'])
+        blueprint.update_yaml_node_types(
+            {'type.six': {'derived_from': 'type.one'}})
+        blueprint.update_yaml_node_templates({
+            'node_six': {'type': 'type.six'},
+            'node_one': {'type': 'type.two'}
+        })
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.one', derived=True),
+            ['node_six'])
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.two'),
+            ['node_one', 'node_two'])
+        blueprint.remove_yaml_node_templates('node_two')
+        blueprint.remove_yaml_node_types('type.six')
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.two'), ['node_one'])
+        self.assertEqual(blueprint.get_derived_node_types('type.one'), set())
+        self.assertNotIn('node_two', blueprint.node_templates)
+
+    def test_16_retranslate_blueprint(self):
+        ctx = self.get_ctx()
+        cfy_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+
+        def assert_up_to_date():
+            self.assertEqual(
+                cfy_migration.retranslate_blueprint().yaml,
+                cfy_migration.translated_blueprint.yaml)
+
+        assert_up_to_date()
+        mapping_yaml = deepcopy(cfy_migration._mapping_yaml)
+        mapping_yaml['mappings']['node.type.four']['mappings'][0][
+            'elements_path'] = 'properties.resource_config.renamed'
+        cfy_migration.update_mapping_yaml(mapping_yaml)
+        assert_up_to_date()
+        mapping_yaml = deepcopy(mapping_yaml)
+        mapping_yaml['mappings']['node.type.two']['mappings'][0][
+            'value'] = 'variable_three'
+        del mapping_yaml['removals'][1]
+        cfy_migration.update_mapping_yaml(mapping_yaml)
+        assert_up_to_date()
+        self.assertIn(
+            'node_two',
+            cfy_migration.retranslate_blueprint().yaml['node_templates'])
+        blueprint_yaml = deepcopy(cfy_migration._blueprint_yaml)
+        blueprint_yaml['node_templates']['node_four'] = {'type': 'type.one'}
+        blueprint_yaml['node_templates']['node_two']['type'] = 'type.one'
+        del blueprint_yaml['node_types']['cloudify.nodes.Root']
+        cfy_migration.update_blueprint_yaml(blueprint_yaml)
+        assert_up_to_date()
+        self.assertNotIn(
+            'node_two',
+            cfy_migration.retranslate_blueprint().yaml['node_templates'])
+
+    def test_17_retranslate_blueprint_from_cache(self):
+        cache_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_directory)
+        ctx = self.get_ctx()
+        cfy_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            self.old_blueprint_file.name,
+            cache_directory=cache_directory)
+        cfy_migration.retranslate_blueprint()
+        restored_migration = CloudifyMigration(
+            ctx, self.migration_mapping_file_name,
+            cache_directory=cache_directory)
+        self.assertIsNotNone(restored_migration._get_translation_state())
+        self.assertEqual(
+            restored_migration.retranslate_blueprint().yaml,
+            restored_migration.translated_blueprint.yaml)
+
+    def test_18_merge_into(self):
+        source = {'a': {'b': 'one', 'c': ['x', 'y']}, 'd': {'e': 'f'}}
+        destination = {'a': {'b': 'two', 'c': ['y', 'z']}, 'd': 'g', 'h': 1}
+        self.assertEqual(
+            merge_into(source, deepcopy(destination)),
+            {'a': {'b': 'one', 'c': ['x', 'y']}, 'd': {'e': 'f'}, 'h': 1})
+        self.assertEqual(
+            merge_into(source, deepcopy(destination), policy='keep'),
+            destination)
+        self.assertEqual(
+            merge_into(source, deepcopy(destination), policy='append_lists'),
+            {'a': {'b': 'one', 'c': ['y', 'z', 'x']}, 'd': {'e': 'f'}, 'h': 1})
+        self.assertRaises(
+            MigrationException,
+            merge_into, source, deepcopy(destination), policy='error')
+        self.assertEqual(
+            merge_into(
+                source, deepcopy(destination),
+                policy=lambda key, new, old: '{0}:{1}'.format(key, old)),
+            {'a': {'b': 'b:two', 'c': 'c:[\'y\', \'z\']'}, 'd': 'd:g', 'h': 1})
+        self.assertEqual(source['a']['c'], ['x', 'y'])
+        self.assertEqual(
+            merge_into(
+                {'p': {'q': 'variable_one'}}, {},
+                MigrationVariable('variable_one', value='one')),
+            {'p': {'q': 'one'}})
+        deep_source = deep_destination = {}
+        for _ in range(5000):
+            deep_source = {'level': deep_source, 'value': 'new'}
+            deep_destination = {'level': deep_destination, 'other': 'old'}
+        merged = merge_into(deep_source, deep_destination)
+        self.assertEqual(merged['value'], 'new')
+        self.assertEqual(merged['other'], 'old')
+
+    def test_19_compile_path(self):
+        get_value, set_value = compile_path('properties.config.name')
+        self.assertEqual(
+            (get_value, set_value), compile_path('properties.config.name'))
+        node = {'properties': {'config': {'name': 'one'}}}
+        self.assertEqual(get_value(node), 'one')
+        self.assertIsNone(get_value({'properties': 'config'}))
+        self.assertEqual(get_value({}, 'default'), 'default')
+        self.assertEqual(
+            compile_path('config.attributes.nested_property')[0](
+                {'config': {'attributes': ['nested_property']}}),
+            'nested_property')
+        cfy_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        self.assertEqual(
+            cfy_migration.variables.get('variable_two').value, 'variable_two')
+        set_value(node, 'two')
+        new_node = {}
+        set_value(new_node, 'two')
+        self.assertEqual(node, new_node)
+        self.assertRaises(
+            MigrationException, set_value, {'properties': 'config'}, 'two')
+        variable = cfy_migration.variables.get('variable_two')
+        self.assertEqual(
+            variable.write({'properties': {'other': 1}}),
+            {'properties': {'other': 1,
+                            'config': {'variable_two': 'variable_two'}}})
+        self.assertRaises(
+            MigrationException, MigrationVariable('variable').write, {})
+        path_index = cfy_migration.blueprint.get_path_index()
+        self.assertEqual(
+            path_index[('node_templates', 'node_one', 'type')], 'type.one')
+        self.assertEqual(
+            path_index[('node_types', 'type.one', 'derived_from')],
+            'cloudify.nodes.Root')
+        for index in range(COMPILED_PATHS_LIMIT):
+            compile_path('properties.path_{0}'.format(index))
+        self.assertNotEqual(
+            (get_value, set_value), compile_path('properties.config.name'))
+
+    def test_20_model_serialization(self):
+        node_template = NodeTemplate(
+            'node_one', {'type': 'type.one', 'properties': {'name': 'one'}})
+        self.assertFalse(hasattr(node_template, '__weakref__'))
+        self.assertRaises(AttributeError, setattr, node_template, 'other', 1)
+        serialized = node_template.to_dict()
+        self.assertEqual(
+            serialized,
+            {'node_one': {'type': 'type.one', 'properties': {'name': 'one'}}})
+        self.assertIs(node_template.to_dict(), serialized)
+        self.assertIs(node_template.__dict__, serialized)
+        self.assertEqual(
+            yaml.safe_load(node_template.to_yaml_fragment()), serialized)
+        properties = node_template.properties
+        self.assertIs(node_template.properties, properties)
+        self.assertEqual(properties['name'].value, 'one')
+        node_template.update_node({'properties': {'name': 'two'}}, None)
+        self.assertIsNot(node_template.properties, properties)
+        self.assertEqual(node_template.properties['name'].value, 'two')
+        self.assertEqual(
+            node_template.to_dict()['node_one']['properties'], {'name': 'two'})
+        self.assertEqual(serialized['node_one']['properties'], {'name': 'one'})
+        copied_template = deepcopy(node_template)
+        self.assertEqual(copied_template.to_dict(), node_template.to_dict())
+        self.assertIsNot(copied_template.definition, node_template.definition)
+
+    def test_21_write_blueprint_file(self):
+        blueprint_yaml = yaml.safe_load(self.old_blueprint_file.read())
+        blueprint_yaml['groups'] = {}
+        f = tempfile.NamedTemporaryFile()
+        write_blueprint_file(f.name, blueprint_yaml)
+        self.assertEqual(read_yaml_file(f.name), blueprint_yaml)
+        lines = [line for line in f.read().splitlines()
+                 if not line.startswith(' ')]
+        self.assertEqual(
+            lines,
+            ['tosca_definitions_version: cloudify_dsl_1_3', 'imports: []',
+             'inputs: {}', 'node_types:', 'node_templates:', 'outputs: {}',
+             'groups: {}'])
+        self.assertEqual(
+            write_blueprint_documents(f.name, iter([blueprint_yaml] * 2)), 2)
+        self.assertEqual(
+            list(read_yaml_documents(f.name)), [blueprint_yaml] * 2)
+
+    def test_22_lazy_blueprint(self):
+        blueprint_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blueprint_directory)
+        blueprint_path = os.path.join(blueprint_directory, 'blueprint.yaml')
+        with open(blueprint_path, 'w') as f:
+            yaml.dump(self.old_blueprint, f, default_flow_style=False)
+            f.write('dsl_definitions:\n  # Copied as it is.\n  a: {b: c}\n')
+        blueprint = MigrationBlueprint.from_file(blueprint_path)
+        self.assertEqual(blueprint.get_node_type('type.one').derived_from,
+                         'cloudify.nodes.Root')
+        self.assertIsNone(blueprint.get_node_type('type.nine'))
+        self.assertIsNotNone(blueprint.get_raw_section('node_types'))
+        self.assertEqual(len(blueprint.imports), len(blueprint.imports))
+        self.assertEqual(blueprint.yaml, read_yaml_file(blueprint_path))
+        cfy_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name)
+        output_path = os.path.join(blueprint_directory, 'output.yaml')
+        result = cfy_migration.translator.translate_file(
+            blueprint_path, output_path)
+        self.assertNotIn('error', result)
+        self.assertEqual(
+            read_yaml_file(output_path),
+            cfy_migration.translator.translate(
+                MigrationBlueprint(read_yaml_file(blueprint_path))).yaml)
+        with open(output_path) as f:
+            self.assertIn('  # Copied as it is.\n', f.read())
+
+    def test_23_validate_mapping(self):
+        mapping_yaml = read_yaml_file(self.migration_mapping_file_name)
+        self.assertEqual(validate_mapping(mapping_yaml), [])
+        mapping_yaml['mappings']['node.type.two']['mappings'].append({
+            'value': 'variable_three',
+            'elements_path': 'properties.config',
+            'elements_types': 'dict.dict.string'})
+        mapping_yaml['mappings']['node.type.three']['mapping_direction'] = \
+            'sideways'
+        mapping_yaml['mappings']['node.type.four']['mappings'][0][
+            'elements_types'] = 'string.dict.string'
+        mapping_yaml['additions'].append({'key': 'type.six', 'add': []})
+        mapping_yaml['removals'][0]['remove'] = ['node_templates', 'inputs']
+        errors = validate_mapping(mapping_yaml)
+        self.assertEqual(len(errors), 6)
+        self.assertIn('unknown mapping_direction sideways', errors[1])
+        self.assertIn('properties.config has 2 elements', errors[2])
+        self.assertRaises(
+            MigrationException, get_translation_plan, mapping_yaml)
+
+    def test_24_estimate_translation(self):
+        cfy_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        estimate = cfy_migration.estimate_translation()
+        self.assertEqual(len(estimate['rules']), 8)
+        self.assertEqual(estimate['node_types'], 8)
+        self.assertEqual(estimate['node_templates'], 5)
+        self.assertEqual(
+            estimate['rules'][-2],
+            {'rule': 'removals', 'key': 'type.one',
+             'node_types': 1, 'node_templates': 1})
+        limited_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            self.old_blueprint_file.name, node_limit=12)
+        self.assertRaises(
+            MigrationException, limited_migration.translator.translate,
+            limited_migration.blueprint)
+
+    def test_25_dry_run(self):
+        cfy_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        output_path = os.path.join(output_directory, 'changes.json')
+        counts = cfy_migration.dry_run(output_path)
+        with open(output_path) as f:
+            changes = json.load(f)
+        self.assertEqual(
+            counts, {'added': 6, 'removed': 4, 'changed': 0})
+        self.assertEqual(len(changes), 10)
+        self.assertIn(
+            {'section': 'node_types', 'key': 'type.one', 'change': 'removed'},
+            changes)
+        self.assertEqual(cfy_migration.dry_run(), counts)
+        self.assertEqual(
+            get_changed_paths(
+                {'a': {'b': 1, 'c': 2}, 'd': 3}, {'a': {'b': 1, 'c': 4}}),
+            {'added': [], 'removed': ['d'], 'changed': ['a.c']})
+
+    def test_26_translate_resource(self):
+        with open(self.migration_mapping_file_name) as f:
+            plan = get_translation_plan(yaml.load(f))
+        self.assertTrue(plan.affects_node_template('node_one', 'type.one'))
+        self.assertTrue(plan.affects_node_template('node_two', 'type.two'))
+        self.assertFalse(
+            plan.affects_node_template('node_three', 'cloudify.nodes.Root'))
+        node_template = self.old_blueprint['node_templates']['node_one']
+        _ctx = self.get_ctx()
+        _ctx._node = MockNodeContext(
+            'node_one', node_template['properties'])
+        _ctx.node.type = node_template['type']
+        self.assertEqual(
+            tasks.translate_resource(
+                self.migration_mapping_file_name, dry_run=True),
+            {'added': 0, 'removed': 1, 'changed': 0})
+        self.assertNotIn(
+            'translated_resource', _ctx.instance.runtime_properties)
+        tasks.translate_resource(self.migration_mapping_file_name)
+        self.assertIsNone(
+            _ctx.instance.runtime_properties['translated_resource'])
+
+    def test_27_translation_report(self):
+        _ctx = self.get_ctx()
+        cfy_migration = CloudifyMigration(
+            _ctx, self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        output_path = os.path.join(output_directory, 'blueprint.yaml')
+        report = cfy_migration.translate_with_report(
+            output_path, store_report=True)
+        self.assertEqual(report['output'], output_path)
+        self.assertEqual(
+            _ctx.instance.runtime_properties['translation_report'], report)
+        for phase in ('mapping_load', 'additions', 'set_variables',
+                      'removals', 'write'):
+            self.assertGreaterEqual(report['phases'][phase]['calls'], 1)
+        self.assertEqual(report['phases']['variables']['calls'], 6)
+        self.assertEqual(
+            report['counters']['bytes_written'],
+            os.path.getsize(output_path))
+        self.assertEqual(report['counters']['node_types_touched'], 8)
+        self.assertEqual(report['counters']['node_templates_touched'], 5)
+        self.assertEqual(report['counters']['merges'], 12)
+
+    def test_28_cached_specification(self):
+        spec = MigrationMappingMemberSpec({
+            'value': 'nested_property',
+            'elements_path': 'properties.config.attributes.nested_property',
+            'elements_types': 'dict.dict.list.string'})
+        self.assertEqual(
+            [element.index for element in spec.elements], [0, 1, 2, 3])
+        self.assertEqual(
+            [element.key for element in spec.elements],
+            ['nested_property', 'attributes', 'config', 'properties'])
+        specification = spec.specification
+        self.assertEqual(
+            specification,
+            {'specification': {'properties': {'config': {
+                'attributes': ['nested_property', 'nested_property']}}}})
+        specification['specification']['properties']['config'][
+            'attributes'].append('changed')
+        self.assertEqual(
+            len(spec.specification['specification']['properties'][
+                'config']['attributes']), 2)
+        with open(self.migration_mapping_file_name) as f:
+            plan = get_translation_plan(yaml.load(f))
+        member = dict(
+            (member.key, member) for member in plan.members)['node.type.five']
+        merged = member.merged_specifications
+        merged['specification'].clear()
+        self.assertEqual(
+            member.merged_specifications, self.merged_mapping_specs)
+
+    def test_29_mapping_indexes(self):
+        with open(self.migration_mapping_file_name) as f:
+            mapping_yaml = yaml.load(f)
+        mapping = MigrationMapping(mapping_yaml)
+        self.assertEqual(
+            [m.key for m in mapping.get_members(node_type='type.five')],
+            ['node.type.five'])
+        self.assertEqual(
+            [m.key for m in mapping.get_members(
+                node_type='type.five', mapping_direction='source')], [])
+        self.assertEqual(
+            len(mapping.get_members(mapping_direction='source')), 2)
+        self.assertEqual(
+            [m.key for m in mapping.get_members(node_name='node_three')],
+            ['node.cloudify.nodes.Root'])
+        self.assertEqual(len(mapping.get_members()), 6)
+        self.assertIsNone(mapping.get_member('node.type.six'))
+        mapping.update_members('node.type.five', MigrationMappingMember(
+            'node.type.five',
+            {'node_type': 'type.six', 'mapping_direction': 'source'}))
+        self.assertEqual(mapping.get_members(node_type='type.five'), [])
+        self.assertEqual(
+            [m.key for m in mapping.get_members(
+                node_type='type.six', mapping_direction='source')],
+            ['node.type.five'])
+        plan = get_translation_plan(mapping_yaml)
+        self.assertEqual(
+            [m.key for m in plan.get_destinations(
+                ['type.five', 'type.four', 'type.one'], ['node_three'])],
+            [m.key for m in plan.destinations
+             if m.node_type in ('type.five', 'type.four')])
+
+    def test_30_compiled_patch(self):
+        variable = MigrationVariable('var', value={'from': 'source'})
+        source = {
+            'properties': {
+                'name': 'var',
+                'tags': ['a', 'b'],
+                'config': {'size': 2},
+                'empty': {},
+                'kept': {}
+            }
+        }
+        destination = {
+            'properties': {
+                'name': 'old',
+                'config': 'not a dict',
+                'kept': {'x': 1},
+                'other': True
+            }
+        }
+        patch = compile_patch(source, variable)
+        patched = apply_patch(patch, deepcopy(destination))
+        self.assertEqual(
+            patched, merge_into(source, deepcopy(destination), variable))
+        self.assertIs(patched['properties']['name'], variable.value)
+        again = apply_patch(patch, deepcopy(destination))
+        self.assertIsNot(
+            again['properties']['tags'], patched['properties']['tags'])
+        cfy_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            self.old_blueprint_file.name)
+        translator = cfy_migration.translator
+        member = cfy_migration.mapping.get_member('node.type.five')
+        self.assertIs(
+            translator._get_patch(member, NodeTemplate),
+            translator._get_patch(member, NodeTemplate))
+
+    def test_31_effective_node_types(self):
+        _blueprint = MigrationBlueprint({
+            'node_types': {
+                'type.base': {
+                    'derived_from': 'cloudify.nodes.Root',
+                    'properties': {
+                        'size': {'default': 1},
+                        'name': {'type': 'string'}
+                    },
+                    'interfaces': {'lifecycle': {'create': 'base.create'}}
+                },
+                'type.middle': {
+                    'derived_from': 'type.base',
+                    'properties': {'size': {'default': 2}},
+                    'interfaces': {'lifecycle': {'delete': 'middle.delete'}}
+                },
+                'type.leaf': {
+                    'derived_from': 'type.middle',
+                    'properties': {'zone': {'default': 'a'}}
+                },
+                'type.other': {}
+            }
+        })
+        leaf = _blueprint.get_effective_node_type('type.leaf')
+        self.assertEqual(
+            leaf['type_hierarchy'],
+            ['cloudify.nodes.Root', 'type.base', 'type.middle', 'type.leaf'])
+        self.assertEqual(leaf['derived_from'], 'type.middle')
+        self.assertEqual(
+            leaf['properties'],
+            {'size': {'default': 2}, 'name': {'type': 'string'},
+             'zone': {'default': 'a'}})
+        self.assertEqual(
+            leaf['interfaces'],
+            {'lifecycle': {'create': 'base.create',
+                           'delete': 'middle.delete'}})
+        self.assertIsNone(_blueprint.get_effective_node_type('type.none'))
+        self.assertEqual(
+            NodeType('type.leaf').generate_node_template(leaf).definition[
+                'properties'],
+            {'size': 2, 'zone': 'a'})
+        resolved = set(_blueprint._effective_node_types)
+        self.assertEqual(
+            resolved, set(['type.base', 'type.middle', 'type.leaf']))
+        _blueprint.get_effective_node_type('type.other')
+        _blueprint.update_yaml_node_types(
+            {'type.middle': {'properties': {'size': {'default': 3}}}})
+        self.assertEqual(
+            set(_blueprint._effective_node_types),
+            set(['type.base', 'type.other']))
+        self.assertEqual(
+            _blueprint.get_effective_node_type('type.leaf')['properties'][
+                'size'], {'default': 3})
+        translated = _blueprint.copy()
+        translated.remove_yaml_node_types('type.base')
+        self.assertEqual(
+            translated.get_effective_node_type('type.leaf')[
+                'type_hierarchy'], ['type.base', 'type.middle', 'type.leaf'])
+        self.assertEqual(
+            _blueprint.get_effective_node_type('type.leaf')[
+                'type_hierarchy'][0], 'cloudify.nodes.Root')
+        _blueprint.update_yaml_node_types(
+            {'type.base': {'derived_from': 'type.leaf'}})
+        self.assertRaises(
+            MigrationException, _blueprint.get_effective_node_type,
+            'type.leaf')
+
+    def test_32_offline_imports(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        mirror = os.path.join(directory, 'mirror')
+        spec = os.path.join(mirror, 'example.com', 'spec')
+        os.makedirs(spec)
+        with open(os.path.join(spec, 'types.yaml'), 'w') as outfile:
+            yaml.dump({
+                'imports': ['plugin.yaml'],
+                'node_types': {
+                    'cloudify.nodes.Root': {
+                        'interfaces': {'lifecycle': {'create': {}}}},
+                    'cloudify.nodes.Compute': {
+                        'derived_from': 'cloudify.nodes.Root',
+                        'properties': {'ip': {'default': ''}}}
+                }
+            }, outfile)
+        with open(os.path.join(spec, 'plugin.yaml'), 'w') as outfile:
+            yaml.dump({'node_types': {'example.Server': {
+                'derived_from': 'cloudify.nodes.Compute'}}}, outfile)
+        local_path = os.path.join(directory, 'local.yaml')
+        with open(local_path, 'w') as outfile:
+            yaml.dump({'node_types': {'local.Type': {}}}, outfile)
+        import_cache = ImportCache(os.path.join(directory, 'cache'), mirror)
+        _blueprint = MigrationBlueprint({
+            'imports': ['http://example.com/spec/types.yaml', local_path],
+            'node_types': {
+                'type.server': {
+                    'derived_from': 'example.Server',
+                    'properties': {'size': {'default': 1}}}
+            }
+        }, import_cache=import_cache)
+        self.assertEqual(
+            sorted(_blueprint.imports[0].node_types),
+            ['cloudify.nodes.Compute', 'cloudify.nodes.Root'])
+        self.assertEqual(
+            sorted(_blueprint.get_imported_node_types()),
+            ['cloudify.nodes.Compute', 'cloudify.nodes.Root',
+             'example.Server', 'local.Type'])
+        effective = _blueprint.get_effective_node_type('type.server')
+        self.assertEqual(
+            effective['type_hierarchy'],
+            ['cloudify.nodes.Root', 'cloudify.nodes.Compute',
+             'example.Server', 'type.server'])
+        self.assertEqual(
+            sorted(effective['properties']), ['ip', 'size'])
+        self.assertEqual(
+            effective['interfaces'], {'lifecycle': {'create': {}}})
+        # Another cache of the directory does not need the mirror.
+        offline_cache = ImportCache(os.path.join(directory, 'cache'))
+        self.assertIn(
+            'example.Server',
+            offline_cache.get('https://example.com/spec/plugin.yaml')[
+                'node_types'])
+        self.assertRaises(
+            MigrationException, offline_cache.get,
+            'http://example.com/spec/missing.yaml')
+        seeded_cache = ImportCache(os.path.join(directory, 'seeded'))
+        self.assertEqual(seeded_cache.seed(mirror), 2)
+        self.assertEqual(
+            seeded_cache.get('http://example.com/spec/types.yaml'),
+            import_cache.get('http://example.com/spec/types.yaml'))
+
+    def test_33_retranslate_inherited_defaults(self):
+        translator = BlueprintTranslator(get_translation_plan({
+            'mappings': {},
+            'additions': [{'key': 'type.leaf', 'type': 'node_type',
+                           'add': ['node_templates']}]
+        }))
+        blueprint_yaml = {
+            'node_types': {
+                'type.base': {'properties': {'size': {'default': 1}}},
+                'type.middle': {'derived_from': 'type.base'},
+                'type.leaf': {'derived_from': 'type.middle'}
+            }
+        }
+        translated, graph = translate_with_graph(
+            translator, MigrationBlueprint(blueprint_yaml))
+        self.assertEqual(
+            translated.yaml['node_templates']['type_leaf_generated'][
+                'properties'], {'size': 1})
+        blueprint_yaml = deepcopy(blueprint_yaml)
+        blueprint_yaml['node_types']['type.base']['properties']['size'][
+            'default'] = 2
+        _blueprint = MigrationBlueprint(blueprint_yaml)
+        retranslated, _, keys = retranslate(
+            translator, _blueprint, translated.yaml, graph)
+        self.assertEqual(keys['node_templates'], set(['type_leaf_generated']))
+        self.assertEqual(
+            retranslated.yaml, translator.translate(_blueprint).yaml)
+        self.assertEqual(
+            retranslated.yaml['node_templates']['type_leaf_generated'][
+                'properties'], {'size': 2})
+
+    def test_34_uncached_imports_are_skipped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        local_path = os.path.join(directory, 'local.yaml')
+        with open(local_path, 'w') as outfile:
+            yaml.dump({'node_types': {'local.Type': {
+                'properties': {'zone': {'default': 'a'}}}}}, outfile)
+        translator = BlueprintTranslator(get_translation_plan({
+            'mappings': {},
+            'additions': [{'key': 'type.server', 'type': 'node_type',
+                           'add': ['node_templates']}]
+        }))
+        _blueprint = MigrationBlueprint({
+            'imports': ['http://example.com/spec/types.yaml', local_path],
+            'node_types': {
+                'type.server': {
+                    'derived_from': 'local.Type',
+                    'properties': {'size': {'default': 1}}}
+            }
+        }, import_cache=ImportCache(os.path.join(directory, 'cache')))
+        self.assertEqual(
+            sorted(_blueprint.get_imported_node_types()), ['local.Type'])
+        translated = translator.translate(_blueprint)
+        self.assertEqual(
+            translated.yaml['node_templates']['type_server_generated'][
+                'properties'], {'size': 1, 'zone': 'a'})
+
+    def test_35_relative_imports_follow_the_blueprint(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.makedirs(os.path.join(directory, 'blueprint', 'types'))
+        with open(os.path.join(
+                directory, 'blueprint', 'types', 'local.yaml'), 'w') as f:
+            yaml.dump({'node_types': {'local.Type': {}}}, f)
+        with open(os.path.join(
+                directory, 'blueprint', 'blueprint.yaml'), 'w') as f:
+            yaml.dump({'imports': ['types/local.yaml']}, f)
+        os.chdir(os.path.join(directory, 'blueprint'))
+        cfy_migration = CloudifyMigration(
+            self.get_ctx(), self.migration_mapping_file_name,
+            'blueprint.yaml',
+            import_cache_directory=os.path.join(directory, 'cache'))
+        os.chdir(directory)
+        self.assertEqual(
+            cfy_migration.blueprint.imports[0].url,
+            os.path.join(directory, 'blueprint', 'types', 'local.yaml'))
+        self.assertEqual(
+            sorted(cfy_migration.blueprint.get_imported_node_types()),
+            ['local.Type'])
+
+    def test_36_node_templates_by_type_from_source(self):
+        blueprint_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blueprint_directory)
+        blueprint_path = os.path.join(blueprint_directory, 'blueprint.yaml')
+        with open(blueprint_path, 'w') as f:
+            f.write(
+                'node_templates:\n'
+                '  node_one:\n'
+                '    # The type.\n'
+                '    type: type.one  # Comment.\n'
+                '    properties:\n'
+                '      type: type.two\n'
+                '  node_two:\n'
+                '    properties: {}\n'
+                '    type: "type.one"\n'
+                '  node_three: {type: type.one}\n'
+                '  node_four:\n'
+                '    type: type.two\n'
+                '  node_five:\n'
+                '    properties: {}\n')
+        blueprint = MigrationBlueprint.from_file(blueprint_path)
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.one'),
+            ['node_one', 'node_three', 'node_two'])
+        self.assertNotIn('node_templates', blueprint._yaml)
+        blueprint.update_yaml_node_templates(
+            {'node_six': {'type': 'type.two'}})
+        blueprint.remove_yaml_node_templates('node_four')
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.two'), ['node_six'])
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('cloudify.nodes.Root'),
+            ['node_five'])
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.one'),
+            MigrationBlueprint(blueprint.yaml).get_node_templates_by_type(
+                'type.one'))
+
+    def test_37_non_ascii_changes(self):
+        old_yaml = {'node_templates': {
+            u'n\xf6de': {'properties': {u'gr\xf6\xdfe': 1, 'name': 'a'}}}}
+        new_yaml = {'node_templates': {
+            u'n\xf6de': {'properties': {u'gr\xf6\xdfe': 2, 1: 'b'}}}}
+        change = list(iter_blueprint_changes(old_yaml, new_yaml))[0]
+        self.assertEqual(change['added'], [u'properties.1'])
+        self.assertEqual(change['removed'], [u'properties.name'])
+        self.assertEqual(change['changed'], [u'properties.gr\xf6\xdfe'])
+        self.assertEqual(
+            format_change(change),
+            u'node_templates n\xf6de: added properties.1, '
+            u'removed properties.name, changed properties.gr\xf6\xdfe')
+        self.assertEqual(
+            get_changed_paths({u'\xe9': 1}, {u'\xe9': 2})['changed'],
+            [u'\xe9'])
+
+    def test_38_lazy_blueprint_non_string_keys(self):
+        blueprint_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blueprint_directory)
+        blueprint_path = os.path.join(blueprint_directory, 'blueprint.yaml')
+        with open(blueprint_path, 'w') as f:
+            f.write(
+                'inputs:\n'
+                '  2:\n'
+                '    default: two\n'
+                '  yes:\n'
+                '    default: true\n'
+                '  name:\n'
+                '    default: name\n'
+                'node_types:\n'
+                '  type.one:\n'
+                '    properties:\n'
+                '      null: {}\n'
+                '      true: {}\n'
+                'node_templates:\n'
+                '  node_one:\n'
+                '    type: type.one\n')
+        blueprint = MigrationBlueprint.from_file(blueprint_path)
+        self.assertEqual(blueprint.inputs[2].definition, {'default': 'two'})
+        self.assertEqual(
+            blueprint.inputs[True].definition, {'default': True})
+        self.assertEqual(
+            sorted(blueprint.get_node_type('type.one').properties),
+            [None, True])
+        self.assertEqual(
+            blueprint.get_node_templates_by_type('type.one'), ['node_one'])
+        self.assertEqual(blueprint.yaml, read_yaml_file(blueprint_path))
+
+    def test_39_translate_blueprints_workflow(self):
+        env = self._get_local_env(
+            {'cloudify.nodes.Root': {}},
+            {'node': {'type': 'cloudify.nodes.Root'}})
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        summary = env.execute('translate_blueprints', {
+            'migration_mapper_resource': 'migration-mapper.yaml',
+            'blueprints': [self.old_blueprint_file.name],
+            'output_directory': output_directory
+        })
+        self.assertEqual(summary['translated'], 1)
+        self.assertEqual(summary['failed'], 0)
+        with open(summary['blueprints'][0]['output']) as f:
+            self.assertIn('type.five', yaml.load(f)['node_types'])
+        self.assertEqual(
+            env.storage.get_node_instances()[0].runtime_properties, {})
+
+    def _execute_translate_resources(self, env, concurrency, dry_run):
+        # Run the workflow, and return the node instance ids of its chains
+        # of tasks.
+        dependencies = []
+        add_dependency = TaskDependencyGraph.add_dependency
+
+        def _add_dependency(graph, src_task, dst_task):
+            dependencies.append((
+                src_task.kwargs['__cloudify_context']['node_id'],
+                dst_task.kwargs['__cloudify_context']['node_id']))
+            return add_dependency(graph, src_task, dst_task)
+
+        with mock.patch.object(
+                TaskDependencyGraph, 'add_dependency', _add_dependency):
+            env.execute('translate_resources', {
+                'migration_mapper_resource': 'migration-mapper.yaml',
+                'concurrency': concurrency,
+                'dry_run': dry_run
+            })
+        chains = dict((instance.id, [instance.id])
+                      for instance in env.storage.get_node_instances())
+        for src, dst in dependencies:
+            chains[src] = chains.pop(dst) + chains[src]
+        return sorted(chains.values())
+
+    def test_40_translate_resources_workflow(self):
+        env = self._get_local_env(
+            {'cloudify.nodes.Root': {},
+             'type.one': {'derived_from': 'cloudify.nodes.Root'},
+             'type.two': {'derived_from': 'cloudify.nodes.Root'}},
+            {'node_one': {'type': 'type.one', 'instances': {'deploy': 2}},
+             'node_two': {'type': 'type.two'},
+             'node_three': {'type': 'cloudify.nodes.Root'}})
+        instances = env.storage.get_node_instances()
+        self.assertEqual(len(instances), 4)
+        chains = self._execute_translate_resources(env, 1, True)
+        self.assertEqual(len(chains), 1)
+        self.assertEqual(
+            sorted(chains[0]), sorted(instance.id for instance in instances))
+        for instance in env.storage.get_node_instances():
+            self.assertEqual(instance.runtime_properties, {})
+        chains = self._execute_translate_resources(env, 3, False)
+        self.assertEqual(sorted(len(chain) for chain in chains), [1, 1, 2])
+        runtime_properties = dict(
+            (instance.node_id, instance.runtime_properties)
+            for instance in env.storage.get_node_instances())
+        self.assertIsNone(
+            runtime_properties['node_one']['translated_resource'])
+        self.assertIn('translated_resource', runtime_properties['node_two'])
+        self.assertEqual(runtime_properties['node_three'], {})
+
+    def test_41_non_ascii_import_url(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        import_url = u'http://example.com/sp\xe9c/types.yaml'
+        import_yaml = {'node_types': {u'caf\xe9.Type': {}}}
+        ImportCache(directory).put(import_url, import_yaml)
+        import_cache = ImportCache(directory)
+        self.assertEqual(import_cache.get(import_url), import_yaml)
+        self.assertEqual(
+            import_cache.get(u'https://example.com/sp\xe9c/types.yaml'),
+            import_yaml)
+        _blueprint = MigrationBlueprint(
+            {'imports': [import_url]}, import_cache=import_cache)
+        self.assertEqual(
+            _blueprint.get_imported_node_types().keys(), [u'caf\xe9.Type'])
+
+    def test_42_unsupported_mapping_members(self):
+        addition = TranslationAddition({
+            'key': 'node_one', 'type': 'node_template',
+            'add': ['node_templates']})
+        for attribute in ('node_type_to_add', 'node_template_to_add'):
+            with self.assertRaises(NonRecoverableError) as raised:
+                getattr(addition, attribute)
+            self.assertIn('node_one', str(raised.exception))
+        with open(self.migration_mapping_file_name) as f:
+            plan = TranslationPlan(yaml.load(f))
+        plan.destinations[0].node_type = None
+        with self.assertRaises(NonRecoverableError) as raised:
+            BlueprintTranslator(plan).set_variables(MigrationBlueprint({}))
+        self.assertIn(plan.destinations[0].key, str(raised.exception))
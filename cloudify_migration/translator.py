@@ -0,0 +1,305 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import logging
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from cloudify.exceptions import NonRecoverableError
+
+from cloudify_migration.blueprint import (
+    MigrationBlueprint,
+    NodeTemplate,
+    NodeType)
+from cloudify_migration.constants import NODE_TEMPS, NODE_TYPES
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.loader import BlueprintIndex
+from cloudify_migration.metrics import (
+    ADDITIONS,
+    MERGES,
+    NODE_TEMPLATES_TOUCHED,
+    NODE_TYPES_TOUCHED,
+    REMOVALS,
+    SET_VARIABLES,
+    VARIABLES,
+    TranslationMetrics)
+from cloudify_migration.variables import MigrationVariables
+from cloudify_migration.utils import compile_patch, read_yaml_documents
+from cloudify_migration.writer import (
+    write_blueprint_documents,
+    write_blueprint_file)
+
+# The translator of a worker process, set up once by _initialize_worker.
+_WORKER_TRANSLATOR = None
+
+
+class BlueprintTranslator(object):
+
+    def __init__(self, plan, logger=None, node_limit=None, metrics=None):
+        """Apply a compiled translation plan to blueprints.
+
+        The translator does not need a Cloudify context, so it can also run
+        in worker processes.
+
+        :param plan: A TranslationPlan.
+        :param logger: Where to log, defaults to the module logger.
+        :param node_limit: Refuse to translate a blueprint when the plan
+            estimates that more node types and node templates than this
+            would be touched.
+        :param metrics: The TranslationMetrics to record phases and
+            counters in.
+        :return: None
+        """
+
+        self.plan = plan
+        self.node_limit = node_limit
+        self.logger = logger or logging.getLogger(__name__)
+        self.metrics = metrics or TranslationMetrics()
+        self._variables = None
+        # Compiled patches, keyed by destination member and node class.
+        self._patches = {}
+        # Set for the duration of a translate call, see translate.
+        self._graph = None
+        self._keys = None
+
+    @property
+    def variables(self):
+        if self._variables is None:
+            # We only assign variables from source mapping members.
+            self._variables = MigrationVariables(self.plan.sources)
+        return self._variables
+
+    def _applies(self, section, key):
+        return self._keys is None or key in self._keys.get(section, ())
+
+    def _touch(self, rule, section, key):
+        self.metrics.count(
+            NODE_TYPES_TOUCHED if section == NODE_TYPES
+            else NODE_TEMPLATES_TOUCHED)
+        if self._graph is not None:
+            self._graph.touch(self.plan.rule_digests[rule], section, key)
+
+    def _effect_additions(self, _blueprint):
+        # The plan only has node type additions, see validate_mapping.
+        for _addition in self.plan.additions:
+            node_type = _addition.node_type_to_add
+            if _addition.add_node_types and \
+                    self._applies(NODE_TYPES, node_type.key):
+                _blueprint.update_yaml_node_types(node_type.to_dict())
+                self.metrics.count(MERGES)
+                self._touch(_addition, NODE_TYPES, node_type.key)
+            # With the defaults that the type inherits in this blueprint.
+            node_template = node_type.generate_node_template(
+                _blueprint.get_effective_node_type(node_type.key))
+            if _addition.add_node_templates and \
+                    self._applies(NODE_TEMPS, node_template.key):
+                _blueprint.update_yaml_node_templates(node_template.to_dict())
+                self.metrics.count(MERGES)
+                self._touch(_addition, NODE_TEMPS, node_template.key)
+
+    def _effect_removals(self, _blueprint):
+        # The plan only has node type removals, see validate_mapping.
+        for _remove in self.plan.removals:
+            if _remove.remove_node_types and \
+                    self._applies(NODE_TYPES, _remove.key):
+                self._touch(_remove, NODE_TYPES, _remove.key)
+                try:
+                    _blueprint.remove_yaml_node_types(_remove.key)
+                except KeyError:
+                    self.logger.error(
+                        'Won\'t remove node type {0}. Not found.'.format(
+                            _remove.key))
+            if _remove.remove_node_templates:
+                for k in _blueprint.get_node_templates_by_type(_remove.key):
+                    if self._applies(NODE_TEMPS, k):
+                        _blueprint.remove_yaml_node_templates(k)
+                        self._touch(_remove, NODE_TEMPS, k)
+
+    def _get_patch(self, member, node_class):
+        # Variables are the same for every blueprint, so the patch of a
+        # member is compiled once and applied to every node it targets.
+        key = (member, node_class)
+        if key not in self._patches:
+            patch = []
+            for spec in member.mapping_specs:
+                # The value of a variable is only extracted from its source
+                # when compile_patch first reads it.
+                with self.metrics.phase(VARIABLES):
+                    patch.extend(compile_patch(
+                        node_class.prepare_spec(
+                            spec.specification['specification']),
+                        self.variables.get(spec.value)))
+            self._patches[key] = tuple(patch)
+        return self._patches[key]
+
+    def _apply_patches(self, node, members):
+        for member in members:
+            node.apply_patch(self._get_patch(member, node.__class__))
+            self.metrics.count(MERGES)
+        return node.to_dict()
+
+    def _set_node_type_variables(self, node_type_key, members, _blueprint):
+        node_type = _blueprint.get_node_type(node_type_key) or \
+            NodeType(node_type_key, {})
+        _blueprint.update_yaml_node_types(
+            self._apply_patches(node_type, members))
+        self.metrics.count(MERGES)
+
+    def _set_node_template_variables(self,
+                                     node_template_key,
+                                     members,
+                                     _blueprint):
+        node_template = _blueprint.get_node_template(node_template_key) or \
+            NodeTemplate(node_template_key, {})
+        _blueprint.update_yaml_node_templates(
+            self._apply_patches(node_template, members))
+        self.metrics.count(MERGES)
+
+    def set_variables(self, _blueprint):
+        if self._keys is None:
+            members = self.plan.destinations
+        else:
+            members = self.plan.get_destinations(
+                self._keys.get(NODE_TYPES, ()), self._keys.get(NODE_TEMPS, ()))
+        # Members are grouped by the node they set variables on, so that
+        # every node is copied and written back once.
+        targets = OrderedDict()
+        for member in members:
+            if member.node_type and not member.node_name:
+                target = (NODE_TYPES, member.node_type)
+            elif member.node_type and member.node_name:
+                target = (NODE_TEMPS, member.node_name)
+            else:
+                raise NonRecoverableError(
+                    'Mapping member {0} has no node_type.'.format(
+                        member.key))
+            if self._applies(*target):
+                targets.setdefault(target, []).append(member)
+        for (section, key), group in targets.iteritems():
+            if section == NODE_TYPES:
+                self._set_node_type_variables(key, group, _blueprint)
+            else:
+                self._set_node_template_variables(key, group, _blueprint)
+            for member in group:
+                self._touch(member, section, key)
+
+    def check_estimate(self, _blueprint):
+        if self.node_limit is None:
+            return
+        estimate = self.plan.estimate(_blueprint)
+        touched = estimate[NODE_TYPES] + estimate[NODE_TEMPS]
+        if touched > self.node_limit:
+            raise MigrationException(
+                'The mapping would touch {0} node types and node templates, '
+                'the limit is {1}.'.format(touched, self.node_limit))
+
+    def translate(self, _blueprint, graph=None, keys=None):
+        """Return a translated copy of _blueprint.
+
+        :param _blueprint: The MigrationBlueprint to translate.
+        :param graph: A TranslationGraph to record which rules touch which
+            node types and node templates in.
+        :param keys: Only translate these node types and node templates,
+            a dict of sets keyed by section. The rest are left as they are.
+        :return: The translated MigrationBlueprint.
+        """
+        self.check_estimate(_blueprint)
+        self._graph = graph
+        self._keys = keys
+        try:
+            _blueprint = _blueprint.copy()
+            with self.metrics.phase(ADDITIONS):
+                self._effect_additions(_blueprint)
+            with self.metrics.phase(SET_VARIABLES):
+                self.set_variables(_blueprint)
+            with self.metrics.phase(REMOVALS):
+                self._effect_removals(_blueprint)
+        finally:
+            self._graph = None
+            self._keys = None
+        return _blueprint
+
+    def translate_file(self, blueprint_path, output_path):
+        """Translate a blueprint file into output_path.
+
+        A single document file is parsed lazily, see BlueprintIndex. A file
+        with several YAML documents is translated document by document into
+        a file with as many documents. Errors are not raised,
+        they are returned in the result.
+
+        :param blueprint_path: The blueprint to translate.
+        :param output_path: Where to write the translated blueprint.
+        :return: A dict describing the result.
+        """
+
+        result = {'blueprint': blueprint_path, 'output': None}
+        try:
+            source = BlueprintIndex(blueprint_path)
+            if source.indexed:
+                # Sections that translation never looks at are copied
+                # from the source file without being parsed.
+                write_blueprint_file(
+                    output_path,
+                    self.translate(MigrationBlueprint(source=source)))
+                documents = 1
+            else:
+                # Each document is read, translated and written before the
+                # next.
+                documents = write_blueprint_documents(
+                    output_path,
+                    (self.translate(MigrationBlueprint(document)).yaml
+                     for document in read_yaml_documents(blueprint_path)))
+            result['output'] = output_path
+            result['documents'] = documents
+        except Exception as e:
+            self.logger.error(
+                'Failed to translate blueprint {0}: {1}'.format(
+                    blueprint_path, str(e)))
+            result['error'] = str(e)
+        return result
+
+
+def _initialize_worker(plan, node_limit):
+    global _WORKER_TRANSLATOR
+    _WORKER_TRANSLATOR = BlueprintTranslator(plan, node_limit=node_limit)
+
+
+def _translate_file_in_worker(job):
+    return _WORKER_TRANSLATOR.translate_file(*job)
+
+
+def translate_files_in_parallel(plan,
+                                jobs,
+                                processes=None,
+                                node_limit=None):
+    """Translate blueprint files in a pool of worker processes.
+
+    The compiled plan is handed to every worker once, when it starts, so
+    forked workers use the parent's copy instead of compiling their own.
+    Only the file paths and the results travel with each job.
+
+    :param plan: A compiled TranslationPlan.
+    :param jobs: A list of (blueprint_path, output_path) tuples.
+    :param processes: The number of workers, defaults to the CPU count.
+    :param node_limit: See BlueprintTranslator.
+    :return: The results of translate_file, in the order of jobs.
+    """
+
+    pool = Pool(processes, _initialize_worker, (plan, node_limit))
+    try:
+        return pool.map(_translate_file_in_worker, jobs)
+    finally:
+        pool.close()
+        pool.join()
@@ -13,10 +13,68 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
 import yaml
 
+from cloudify_migration.constants import (
+    MERGE_APPEND_LISTS,
+    MERGE_ERROR,
+    MERGE_KEEP,
+    MERGE_OVERWRITE,
+    YAML_FILE_EXTENSIONS)
 from cloudify_migration.exceptions import MigrationException
 
+# Getters and setters of compile_path, keyed by elements path, least
+# recently used
+# first. Only the last COMPILED_PATHS_LIMIT paths are kept.
+_COMPILED_PATHS = OrderedDict()
+COMPILED_PATHS_LIMIT = 1024
+
+# Use libyaml when PyYAML was built with it, it is many times faster.
+try:
+    from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader
+
+
+class FrozenDict(tuple):
+    """The (key, value) pairs of a frozen dict, see freeze_tree.
+    """
+    __slots__ = ()
+
+
+class FrozenList(tuple):
+    """The items of a frozen list, see freeze_tree.
+    """
+    __slots__ = ()
+
+
+def freeze_tree(tree):
+    """Return an immutable copy of a tree of dicts and lists, which can be
+    cached and shared. thaw_tree turns it back into dicts and lists.
+    """
+    if isinstance(tree, dict):
+        return FrozenDict(
+            (key, freeze_tree(value)) for key, value in tree.iteritems())
+    elif isinstance(tree, list):
+        return FrozenList(freeze_tree(value) for value in tree)
+    return tree
+
+
+def thaw_tree(tree):
+    """Return a new tree of dicts and lists from a frozen one. It is a
+    copy, so callers may change it.
+    """
+    if isinstance(tree, FrozenDict):
+        return dict((key, thaw_tree(value)) for key, value in tree)
+    elif isinstance(tree, FrozenList):
+        return [thaw_tree(value) for value in tree]
+    return tree
+
 
 def get_value_by_key(dictionary, find_key):
     if not isinstance(dictionary, dict):
@@ -30,6 +88,92 @@ def get_value_by_key(dictionary, find_key):
             return
 
 
+def compile_path(elements_path):
+    """Compile a dotted elements_path, like properties.config.name, into a
+    (getter, setter) tuple. Paths are compiled once, while they are in the
+    cache.
+
+    getter(tree, default=None) returns the value at the path in tree, or
+    default if it is not there. Inside a list, a key finds an equal item.
+    setter(tree, value) puts value at the path in tree, adding dicts for any
+    missing keys on the way.
+    """
+    accessors = _COMPILED_PATHS.pop(elements_path, None)
+    if accessors is None:
+        keys = tuple(elements_path.split('.'))
+        parent_keys, last_key = keys[:-1], keys[-1]
+
+        def getter(tree, default=None):
+            for key in keys:
+                if isinstance(tree, dict) and key in tree:
+                    tree = tree[key]
+                elif isinstance(tree, list) and key in tree:
+                    tree = key
+                else:
+                    return default
+            return tree
+
+        def setter(tree, value):
+            for key in parent_keys:
+                node = tree.get(key)
+                if not isinstance(node, dict):
+                    if node is not None:
+                        raise MigrationException(
+                            'Cannot set {0}, {1} is not a dict.'.format(
+                                elements_path, key))
+                    node = tree[key] = {}
+                tree = node
+            tree[last_key] = value
+
+        accessors = (getter, setter)
+        if len(_COMPILED_PATHS) >= COMPILED_PATHS_LIMIT:
+            _COMPILED_PATHS.popitem(last=False)
+    _COMPILED_PATHS[elements_path] = accessors
+    return accessors
+
+
+def get_path_index(tree):
+    """Index every value of a tree by its path in one pass.
+
+    :param tree: A dict, like a blueprint YAML.
+    :return: A dict from key tuples to the values at those paths.
+    """
+    index = {}
+    stack = [((), tree)]
+    while stack:
+        path, node = stack.pop()
+        for key, value in node.iteritems():
+            value_path = path + (key,)
+            index[value_path] = value
+            if isinstance(value, dict):
+                stack.append((value_path, value))
+    return index
+
+
+def get_yaml_digest(yaml_content):
+    """Return a stable content hash of a parsed YAML document.
+    """
+    serialized = json.dumps(yaml_content, sort_keys=True, default=str)
+    return hashlib.sha256(serialized).hexdigest()
+
+
+def get_yaml_file_paths(paths):
+    """Expand a list of files and directories into a list of YAML files.
+    Directories are searched recursively, in name order.
+    """
+    file_paths = []
+    for path in paths:
+        if not os.path.isdir(path):
+            file_paths.append(path)
+            continue
+        for root, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith(YAML_FILE_EXTENSIONS):
+                    file_paths.append(os.path.join(root, file_name))
+    return file_paths
+
+
 def merge_dicts(_source, _destination, variable=None):
 
     # TODO: I am uncertain about this condition.
@@ -55,17 +199,169 @@ def merge_dicts(_source, _destination, variable=None):
     return _source
 
 
-def read_yaml_file(file_path):
+def _merge_overwrite(key, source_value, destination_value):
+    return source_value
+
+
+def _merge_keep(key, source_value, destination_value):
+    return destination_value
+
+
+def _merge_append_lists(key, source_value, destination_value):
+    if isinstance(source_value, list) and \
+            isinstance(destination_value, list):
+        return destination_value + [
+            item for item in source_value if item not in destination_value]
+    return source_value
+
+
+def _merge_error(key, source_value, destination_value):
+    if source_value != destination_value:
+        raise MigrationException(
+            'Conflicting values for {0}: {1!r} and {2!r}.'.format(
+                key, source_value, destination_value))
+    return destination_value
+
+
+MERGE_POLICIES = {
+    MERGE_APPEND_LISTS: _merge_append_lists,
+    MERGE_ERROR: _merge_error,
+    MERGE_KEEP: _merge_keep,
+    MERGE_OVERWRITE: _merge_overwrite,
+}
+
+
+def merge_into(source, destination, variable=None, policy=MERGE_OVERWRITE):
+    """Merge source into destination and return destination.
+
+    The trees are walked with a stack rather than recursion, so there is no
+    limit on their depth, and source is never changed. Dicts in source are
+    merged into the dicts at the same keys in destination. Any other value
+    that is already in destination is a conflict, which the policy resolves.
+
+    :param source: The dict to merge from.
+    :param destination: The dict to merge into.
+    :param variable: A MigrationVariable. Values of source that equal its
+        key are replaced with its value.
+    :param policy: One of MERGE_POLICIES, or a callable that takes the key,
+        the source value and the destination value and returns the value
+        to keep.
+    :return: destination
+    """
+
+    resolve = MERGE_POLICIES[policy] if policy in MERGE_POLICIES else policy
+    stack = [(source, destination)]
+    while stack:
+        _source, _destination = stack.pop()
+        for key, value in _source.iteritems():
+            if isinstance(value, dict):
+                if key in _destination and \
+                        not isinstance(_destination[key], dict):
+                    resolved = resolve(key, value, _destination[key])
+                    if resolved is not value:
+                        _destination[key] = resolved
+                        continue
+                    del _destination[key]
+                node = _destination.get(key)
+                if node is None:
+                    node = _destination[key] = {}
+                stack.append((value, node))
+                continue
+            if variable and value == variable.key:
+                value = variable.value
+            if key in _destination:
+                value = resolve(key, value, _destination[key])
+            _destination[key] = value
+    return destination
+
+
+def compile_patch(source, variable=None):
+    """Compile a dict into a patch, which apply_patch merges into a tree
+    the way merge_into(source, tree, variable) would, with the default
+    policy. Compiling walks source once, applying only sets the paths.
+
+    :param source: The dict to merge from.
+    :param variable: A MigrationVariable, see merge_into.
+    :return: A tuple of (key tuple, frozen value) pairs. An empty
+        FrozenDict only makes sure there is a dict at its path.
+    """
+
+    patch = []
+    stack = [((), source)]
+    while stack:
+        path, _source = stack.pop()
+        for key, value in _source.iteritems():
+            value_path = path + (key,)
+            if isinstance(value, dict):
+                if value:
+                    stack.append((value_path, value))
+                else:
+                    patch.append((value_path, FrozenDict()))
+                continue
+            if variable and value == variable.key:
+                # Variable values are merged as they are, not copied.
+                patch.append((value_path, variable.value))
+            else:
+                patch.append((value_path, freeze_tree(value)))
+    return tuple(patch)
+
+
+def apply_patch(patch, tree):
+    """Apply a compile_patch patch to tree, and return tree.
+    """
+    for path, value in patch:
+        node = tree
+        for key in path[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                child = node[key] = {}
+            node = child
+        if isinstance(value, FrozenDict):
+            if not isinstance(node.get(path[-1]), dict):
+                node[path[-1]] = {}
+        else:
+            node[path[-1]] = thaw_tree(value)
+    return tree
+
+
+def read_yaml_file(file_path, loader=YamlLoader):
+    with open(file_path, 'r') as stream:
+        try:
+            return yaml.load(stream, Loader=loader)
+        except yaml.YAMLError as e:
+            raise MigrationException('Invalid YAML: {0}'.format(str(e)))
+
+
+def read_yaml_documents(file_path, loader=YamlLoader):
+    """Yield the documents of a multi-document YAML file one at a time.
+    """
     with open(file_path, 'r') as stream:
         try:
-            return yaml.load(stream)
+            for document in yaml.load_all(stream, Loader=loader):
+                yield document
+        except yaml.YAMLError as e:
+            raise MigrationException('Invalid YAML: {0}'.format(str(e)))
+
+
+def dump_yaml(yaml_content, dumper=YamlDumper):
+    """Return yaml_content as a YAML string.
+    """
+    return yaml.dump(yaml_content, Dumper=dumper, default_flow_style=False)
+
+
+def write_yaml_file(file_path, yaml_content, dumper=YamlDumper):
+    with open(file_path, 'w') as outfile:
+        try:
+            yaml.dump(yaml_content, outfile,
+                      Dumper=dumper, default_flow_style=False)
         except yaml.YAMLError as e:
             raise MigrationException('Invalid YAML: {0}'.format(str(e)))
 
 
-def write_yaml_file(file_path, yaml_content):
+def write_yaml_documents(file_path, documents, dumper=YamlDumper):
     with open(file_path, 'w') as outfile:
         try:
-            yaml.dump(yaml_content, outfile, default_flow_style=False)
+            yaml.dump_all(documents, outfile,
+                          Dumper=dumper, default_flow_style=False)
         except yaml.YAMLError as e:
             raise MigrationException('Invalid YAML: {0}'.format(str(e)))
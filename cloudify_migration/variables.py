@@ -13,14 +13,94 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+from cloudify_migration.exceptions import MigrationException
 from cloudify_migration.utils import get_value_by_key
 
 
 class MigrationVariable(object):
 
-    def __init__(self, key, spec=None, value=None):
+    def __init__(self,
+                 key,
+                 spec=None,
+                 value=None,
+                 get_path_value=None,
+                 set_path_value=None):
         self.key = key
-        if spec and not value:
-            self.value = get_value_by_key(spec, key)
-        else:
-            self.value = value
+        self._spec = spec if spec and not value else None
+        self._value = value
+        self._get_path_value = get_path_value
+        self._set_path_value = set_path_value
+
+    @property
+    def value(self):
+        # The spec is only searched the first time the value is needed.
+        if self._spec is not None:
+            if self._get_path_value:
+                self._value = self._get_path_value(self._spec)
+            else:
+                self._value = get_value_by_key(self._spec, self.key)
+            self._spec = None
+        return self._value
+
+    def write(self, tree):
+        """Put the value at the variable's path in tree, like a node
+        definition, and return tree.
+        """
+        if self._set_path_value is None:
+            raise MigrationException(
+                'Variable {0} has no path to write to.'.format(self.key))
+        self._set_path_value(tree, self.value)
+        return tree
+
+
+class MigrationVariables(object):
+
+    def __init__(self, mapping_members):
+        """Index the variables that a list of mapping members provide.
+
+        Variables are keyed by the value of the mapping spec that defines
+        them and only built when they are first looked up.
+
+        :param mapping_members: The source mapping members.
+        :return: None
+        """
+
+        self._mapping_specs = {}
+        self._variables = {}
+        for member in mapping_members:
+            for mapping_spec in member.mapping_specs:
+                self._mapping_specs[mapping_spec.value] = mapping_spec
+
+    def __contains__(self, key):
+        return key in self._mapping_specs
+
+    def __getitem__(self, key):
+        if key not in self._variables:
+            mapping_spec = self._mapping_specs[key]
+            self._variables[key] = MigrationVariable(
+                key,
+                mapping_spec.specification['specification'],
+                get_path_value=mapping_spec.get_path_value,
+                set_path_value=mapping_spec.set_path_value)
+        return self._variables[key]
+
+    def __iter__(self):
+        return iter(self._mapping_specs)
+
+    def __len__(self):
+        return len(self._mapping_specs)
+
+    def get(self, key, default=None):
+        if key not in self._mapping_specs:
+            return default
+        return self[key]
+
+    def keys(self):
+        return self._mapping_specs.keys()
+
+    def iteritems(self):
+        for key in self._mapping_specs:
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
@@ -0,0 +1,164 @@
+########
+# Copyright (c) 2018 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import yaml
+
+from cloudify_migration.blueprint import MigrationBlueprint
+from cloudify_migration.constants import (
+    IMPORTS,
+    INPUTS,
+    NODE_TEMPS,
+    NODE_TYPES,
+    OUTPUTS,
+    TOSCA_VERSION)
+from cloudify_migration.exceptions import MigrationException
+from cloudify_migration.utils import YamlDumper
+
+# The order that blueprint sections are written in. Any other sections
+# follow them, sorted by name.
+BLUEPRINT_SECTIONS = (
+    TOSCA_VERSION, IMPORTS, INPUTS, NODE_TYPES, NODE_TEMPS, OUTPUTS)
+
+# The sections that are written one entry at a time.
+STREAMED_SECTIONS = (NODE_TYPES, NODE_TEMPS)
+
+
+class BlueprintWriter(object):
+
+    def __init__(self, stream, dumper=YamlDumper):
+        """Write blueprint YAML to a file object a section at a time.
+
+        Only one section, or one entry of a streamed section, is turned
+        into YAML at a time, so writing never needs a YAML representation
+        of the whole blueprint.
+
+        :param stream: A file object to write to.
+        :param dumper: The PyYAML dumper class.
+        :return: None
+        """
+
+        self.stream = stream
+        self.dumper = dumper
+        self.documents = 0
+        self.bytes_written = 0
+
+    def _write(self, text):
+        self.stream.write(text)
+        self.bytes_written += len(text)
+
+    def _dump(self, yaml_content, indent=''):
+        try:
+            fragment = yaml.dump(
+                yaml_content, Dumper=self.dumper, default_flow_style=False)
+        except yaml.YAMLError as e:
+            raise MigrationException('Invalid YAML: {0}'.format(str(e)))
+        for line in fragment.splitlines(True):
+            self._write(indent + line)
+
+    def write_section(self, key, value):
+        self._dump({key: value})
+
+    def write_entries(self, key, entries):
+        """Write a section from an iterable of (name, definition) pairs.
+        Entries are written as they come, so they may be produced lazily.
+        """
+        empty = True
+        for name, definition in entries:
+            if empty:
+                self._write('{0}:\n'.format(key))
+                empty = False
+            self._dump({name: definition}, '  ')
+        if empty:
+            self.write_section(key, {})
+
+    def write_blueprint(self, blueprint_yaml):
+        """Write one blueprint document. Node types and node templates are
+        written one at a time, sorted by name, so that the output is stable.
+        """
+        if self.documents:
+            self._write('---\n')
+        self.documents += 1
+        for key in get_section_order(blueprint_yaml):
+            value = blueprint_yaml[key]
+            if key in STREAMED_SECTIONS and isinstance(value, dict):
+                self.write_entries(
+                    key, ((name, value[name]) for name in sorted(value)))
+            else:
+                self.write_section(key, value)
+
+    def write_migration_blueprint(self, blueprint):
+        """Write one MigrationBlueprint document. Sections and entries that
+        were never parsed from its source file are copied as they are.
+        """
+        if self.documents:
+            self._write('---\n')
+        self.documents += 1
+        for key in get_section_order(blueprint.get_section_keys()):
+            raw_section = blueprint.get_raw_section(key)
+            if raw_section is not None:
+                self._write_raw(raw_section)
+            elif key in STREAMED_SECTIONS and blueprint.has_entries(key):
+                self._write_mixed_entries(key, blueprint)
+            else:
+                self.write_section(key, blueprint.get_section(key))
+
+    def _write_raw(self, text):
+        self._write(text if text.endswith('\n') else text + '\n')
+
+    def _write_mixed_entries(self, key, blueprint):
+        # Parsed and raw entries must line up with each other.
+        indent = ' ' * (blueprint.get_entry_indent(key) or 2)
+        empty = True
+        for name, definition, raw_entry in blueprint.iter_section_entries(key):
+            if empty:
+                self._write('{0}:\n'.format(key))
+                empty = False
+            if raw_entry is not None:
+                self._write_raw(raw_entry)
+            else:
+                self._dump({name: definition}, indent)
+        if empty:
+            self.write_section(key, {})
+
+
+def get_section_order(blueprint_yaml):
+    sections = [key for key in BLUEPRINT_SECTIONS if key in blueprint_yaml]
+    sections.extend(
+        sorted(key for key in blueprint_yaml if key not in BLUEPRINT_SECTIONS))
+    return sections
+
+
+def write_blueprint_file(file_path, blueprint, dumper=YamlDumper):
+    """Write a blueprint, either its YAML or a MigrationBlueprint, and
+    return the number of bytes written.
+    """
+    with open(file_path, 'w') as outfile:
+        writer = BlueprintWriter(outfile, dumper)
+        if isinstance(blueprint, MigrationBlueprint):
+            writer.write_migration_blueprint(blueprint)
+        else:
+            writer.write_blueprint(blueprint)
+        return writer.bytes_written
+
+
+def write_blueprint_documents(file_path, documents, dumper=YamlDumper):
+    """Write blueprint documents to a multi-document file. documents may be
+    a generator, each document is written before the next is asked for.
+    """
+    with open(file_path, 'w') as outfile:
+        writer = BlueprintWriter(outfile, dumper)
+        for document in documents:
+            writer.write_blueprint(document)
+        return writer.documents